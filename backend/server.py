@@ -1,34 +1,480 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, Request, Response, Query
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse, PlainTextResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.datastructures import Headers, MutableHeaders
 import os
 import logging
+import asyncio
+import time
+from bisect import bisect_left
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple, TYPE_CHECKING
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from contextlib import asynccontextmanager
 import uuid
-from datetime import datetime, timezone
-from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionResponse, CheckoutStatusResponse, CheckoutSessionRequest
+import json
+import base64
+import hashlib
+import hmac
+import math
+import csv
+import io
+import zlib
+import gzip as gzip_module
+import orjson
+from datetime import datetime, timezone, timedelta
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+try:
+    import brotli
+except ImportError:
+    # Brotli is optional; without it responses are only gzip-compressed
+    brotli = None
+
+# The payment SDK (and the Stripe library under it) is imported on a payment worker thread,
+# by the startup warm-up or the first call
+if TYPE_CHECKING:
+    from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionResponse, CheckoutStatusResponse
 
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Metrics, rendered in Prometheus text format
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def format_labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._series: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = format_labels(self.labels + ("le",), label_values + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.labels + ("le",), label_values + ("+Inf",))
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class Gauge:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge", f"{self.name} {self.value}"]
+
+request_latency = Histogram("http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status"))
+requests_in_flight = Gauge("http_requests_in_flight", "HTTP requests currently being served")
+db_latency = Histogram("mongo_operation_duration_seconds", "MongoDB operation latency", ("collection", "operation"))
+payment_latency = Histogram("payment_request_duration_seconds", "Payment provider call latency", ("operation", "outcome"))
+webhook_lag = Gauge("webhook_last_batch_lag_seconds", "Delay between receipt and application of the last webhook batch")
+webhook_applied = Gauge("webhook_events_applied", "Webhook events applied by this worker")
+status_cache_entries = Gauge("status_cache_entries", "Checkout statuses held in the status cache")
+writes_shed = Gauge("write_requests_shed", "POST requests refused by the concurrency cap")
+payment_breaker_state = Gauge("payment_breaker_state", "Payment provider circuit breaker state (0 closed, 1 half open, 2 open)")
+payment_breaker_trips = Gauge("payment_breaker_trips", "Times the payment provider circuit breaker has opened")
+status_stream_subscribers = Gauge("status_stream_subscribers", "Open checkout status streams waiting for a change")
+METRICS = [
+    request_latency, requests_in_flight, db_latency, payment_latency, webhook_lag, webhook_applied,
+    status_cache_entries, writes_shed, payment_breaker_state, payment_breaker_trips, status_stream_subscribers
+]
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        requests_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            requests_in_flight.dec()
+            # Label by route template so path parameters do not explode cardinality
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            request_latency.observe(time.perf_counter() - start, scope["method"], path, status_code)
+
+# Response compression and conditional GETs
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/x-ndjson", "application/javascript", "application/xml")
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+def new_compressor(encoding: str):
+    # Returns (compress, sync flush, finish)
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=brotli_quality)
+        return compressor.process, compressor.flush, compressor.finish
+    compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+    return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+def make_etag(*parts) -> str:
+    return '"' + hashlib.sha256("|".join(str(part) for part in parts).encode()).hexdigest()[:32] + '"'
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        compress = flush = finish = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start_message, compress, flush, finish, passthrough
+            if message["type"] == "http.response.start":
+                # Hold the headers until the first body chunk shows whether compression pays off
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compress is None:
+                headers = MutableHeaders(raw=start_message["headers"])
+                content_type = headers.get("content-type", "")
+                if (
+                    "content-encoding" in headers
+                    or not content_type.startswith(COMPRESSIBLE_TYPES)
+                    or content_type.startswith("text/event-stream")
+                    or (not more_body and len(body) < self.minimum_size)
+                ):
+                    passthrough = True
+                    await send(start_message)
+                    await send(message)
+                    return
+
+                compress, flush, finish = new_compressor(encoding)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                # The encoded bytes differ from the identity body the tag was computed on
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    headers["ETag"] = "W/" + etag
+                if "content-length" in headers:
+                    del headers["content-length"]
+                if not more_body:
+                    body = compress(body) + finish()
+                    headers["Content-Length"] = str(len(body))
+                    await send(start_message)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                await send(start_message)
+
+            # Flush every chunk so streamed responses keep their time to first byte
+            chunk = compress(body) + (flush() if more_body else finish())
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+class ETagMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+
+        if_none_match = Headers(scope=scope).get("if-none-match")
+        start_message = None
+        passthrough = False
+
+        async def send_with_etag(message):
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            passthrough = True
+            headers = MutableHeaders(raw=start_message["headers"])
+            # Streamed bodies are never buffered just to hash them
+            if start_message["status"] != 200 or message.get("more_body", False):
+                await send(start_message)
+                await send(message)
+                return
+
+            etag = headers.get("etag")
+            if etag is None:
+                etag = '"' + hashlib.sha256(message.get("body", b"")).hexdigest()[:32] + '"'
+                headers["ETag"] = etag
+            if etag_matches(if_none_match, etag):
+                for header in ("content-length", "content-type"):
+                    if header in headers:
+                        del headers[header]
+                await send({"type": "http.response.start", "status": 304, "headers": start_message["headers"]})
+                await send({"type": "http.response.body", "body": b""})
+                return
+            await send(start_message)
+            await send(message)
+
+        await self.app(scope, receive, send_with_etag)
+
+async def timed_db_operation(collection: str, operation: str, awaitable):
+    start = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        db_latency.observe(time.perf_counter() - start, collection, operation)
+
+TIMED_CURSOR_METHODS = {"to_list", "explain"}
+TIMED_COLLECTION_METHODS = {
+    "insert_one", "insert_many", "find_one", "find_one_and_update", "update_one", "update_many",
+    "replace_one", "delete_one", "delete_many", "bulk_write", "count_documents",
+    "estimated_document_count", "create_index"
+}
+
+class InstrumentedCursor:
+    def __init__(self, cursor, collection: str, operation: str):
+        self._cursor = cursor
+        self._collection = collection
+        self._operation = operation
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            # Chaining methods (sort, limit, ...) return the cursor itself
+            if result is self._cursor:
+                return self
+            if name in TIMED_CURSOR_METHODS:
+                return timed_db_operation(self._collection, self._operation, result)
+            return result
+        return call
+
+    def __aiter__(self):
+        return self._cursor.__aiter__()
+
+class InstrumentedCollection:
+    def __init__(self, collection):
+        self._collection = collection
+        self._name = collection.name
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name in TIMED_COLLECTION_METHODS:
+            def timed(*args, **kwargs):
+                return timed_db_operation(self._name, name, attr(*args, **kwargs))
+            return timed
+        if name in ("find", "aggregate"):
+            def cursor(*args, **kwargs):
+                return InstrumentedCursor(attr(*args, **kwargs), self._name, name)
+            return cursor
+        return attr
+
+class InstrumentedDatabase:
+    def __init__(self, database):
+        self._database = database
+        self._collections: Dict[str, InstrumentedCollection] = {}
 
-# Create the main app without a prefix
-app = FastAPI()
+    def __getitem__(self, name: str) -> InstrumentedCollection:
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = InstrumentedCollection(self._database[name])
+        return collection
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        attr = getattr(self._database, name)
+        # Attribute access on a Motor database yields collections for unknown names
+        if hasattr(attr, "insert_one"):
+            return self[name]
+        return attr
+
+# MongoDB connection, created per worker on startup (Motor clients are not fork-safe)
+mongo_url = os.environ['MONGO_URL']
+mongo_db_name = os.environ['DB_NAME']
+mongo_max_pool_size = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))
+mongo_min_pool_size = int(os.environ.get('MONGO_MIN_POOL_SIZE', '0'))
+mongo_server_selection_timeout_ms = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+mongo_connect_timeout_ms = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '5000'))
+mongo_socket_timeout_ms = int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', '20000'))
+client = None
+db = None
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
 # Stripe integration
 stripe_api_key = os.environ.get('STRIPE_API_KEY', 'sk_test_emergent')
+stripe_pool_size = int(os.environ.get('STRIPE_POOL_SIZE', '10'))
+stripe_timeout = float(os.environ.get('STRIPE_TIMEOUT', '30'))
+# Every provider call gets a deadline; after PAYMENT_BREAKER_THRESHOLD consecutive failures
+# the breaker opens and calls fail fast for PAYMENT_BREAKER_RESET seconds
+payment_call_timeout = float(os.environ.get('PAYMENT_CALL_TIMEOUT', '10'))
+payment_breaker_threshold = int(os.environ.get('PAYMENT_BREAKER_THRESHOLD', '5'))
+payment_breaker_reset = float(os.environ.get('PAYMENT_BREAKER_RESET', '30'))
+# Public origin used for Stripe redirect and webhook URLs; without it the request's Host is used
+public_base_url = os.environ.get('PUBLIC_BASE_URL', '').rstrip('/')
+
+# Application-scoped payment client, created on startup
+payment_client = None
+
+# Contact write path: "direct" inserts per request, "flush" acks after the
+# buffered batch is written, "enqueue" acks as soon as the form is buffered
+contact_write_mode = os.environ.get('CONTACT_WRITE_MODE', 'direct')
+contact_buffer_size = int(os.environ.get('CONTACT_BUFFER_SIZE', '50'))
+contact_buffer_window = float(os.environ.get('CONTACT_BUFFER_WINDOW_MS', '20')) / 1000
+
+# Webhook ingestion workers
+webhook_workers = int(os.environ.get('WEBHOOK_WORKERS', '2'))
+webhook_batch_size = int(os.environ.get('WEBHOOK_BATCH_SIZE', '100'))
+webhook_max_attempts = int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', '8'))
+# Applied events are kept this long so provider retries are still recognised as duplicates
+webhook_event_retention = int(os.environ.get('WEBHOOK_EVENT_RETENTION', str(7 * 86400)))
+
+# Idempotency-Key replay window for checkout session creation
+idempotency_ttl = int(os.environ.get('IDEMPOTENCY_TTL', '86400'))
+# How long an in-progress key stays locked; a retry takes over a key whose owner died
+idempotency_lease = float(os.environ.get('IDEMPOTENCY_LEASE', '20'))
+
+# Plan catalog: "static" serves PLANS, "file" reads PLANS_FILE, "mongo" reads the plans collection
+plans_source = os.environ.get('PLANS_SOURCE', 'static')
+plans_file = os.environ.get('PLANS_FILE', str(ROOT_DIR / 'plans.json'))
+plans_reload_interval = float(os.environ.get('PLANS_RELOAD_INTERVAL', '60'))
+plans_max_age = int(os.environ.get('PLANS_MAX_AGE', '300'))
+
+# Reconciliation of stale pending transactions against the payment provider
+sweep_interval = float(os.environ.get('SWEEP_INTERVAL', '300'))
+sweep_min_age = float(os.environ.get('SWEEP_MIN_AGE', '900'))
+sweep_batch_size = int(os.environ.get('SWEEP_BATCH_SIZE', '100'))
+sweep_concurrency = int(os.environ.get('SWEEP_CONCURRENCY', '4'))
+sweep_rate = float(os.environ.get('SWEEP_RATE', '10'))
+
+# Rate limits on public POST endpoints, as "<requests>/<seconds>" per client IP and per email.
+# RATE_LIMIT_BACKEND=mongo shares the counters between workers.
+rate_limit_enabled = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+rate_limit_backend = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+rate_limit_contact = os.environ.get('RATE_LIMIT_CONTACT', '5/60')
+rate_limit_checkout = os.environ.get('RATE_LIMIT_CHECKOUT', '10/60')
+rate_limit_max_keys = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '100000'))
+# Admin endpoints (exports, stats, plan reload, reconciliation) need this key in the
+# X-Admin-Key header; while it is unset they are disabled
+admin_api_key = os.environ.get('ADMIN_API_KEY', '')
+# Proxies in front of the app that append to X-Forwarded-For; 0 trusts only the peer address
+trusted_proxy_count = int(os.environ.get('TRUSTED_PROXY_COUNT', '1'))
+max_concurrent_writes = int(os.environ.get('MAX_CONCURRENT_WRITES', '200'))
+
+# Exports
+export_batch_size = int(os.environ.get('EXPORT_BATCH_SIZE', '1000'))
+
+# Retention: contact submissions expire through a TTL index after CONTACT_RETENTION_DAYS;
+# terminal transactions older than TRANSACTION_ARCHIVE_DAYS move to the archive
+# collection, or to gzipped JSONL segments in ARCHIVE_DIR when ARCHIVE_TARGET=files.
+# 0 disables either one.
+contact_retention_days = int(os.environ.get('CONTACT_RETENTION_DAYS', '0'))
+transaction_archive_days = int(os.environ.get('TRANSACTION_ARCHIVE_DAYS', '0'))
+archive_target = os.environ.get('ARCHIVE_TARGET', 'collection')
+archive_dir = Path(os.environ.get('ARCHIVE_DIR', str(ROOT_DIR / 'archive')))
+archive_batch_size = int(os.environ.get('ARCHIVE_BATCH_SIZE', '500'))
+archive_interval = float(os.environ.get('ARCHIVE_INTERVAL', '3600'))
+
+# Response compression: bodies smaller than COMPRESSION_MIN_SIZE bytes are sent as is
+compression_min_size = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+gzip_level = int(os.environ.get('GZIP_LEVEL', '6'))
+brotli_quality = int(os.environ.get('BROTLI_QUALITY', '4'))
+
+# Checkout status cache
+status_cache_ttl = float(os.environ.get('STATUS_CACHE_TTL', '2'))
+status_cache_size = int(os.environ.get('STATUS_CACHE_SIZE', '10000'))
+
+# Checkout status streams: waiters are woken in-process; with several workers set
+# STATUS_EVENTS_SOURCE=change_stream so updates made by any worker reach every stream
+status_events_source = os.environ.get('STATUS_EVENTS_SOURCE', 'local')
+status_stream_heartbeat = float(os.environ.get('STATUS_STREAM_HEARTBEAT', '15'))
+status_stream_timeout = float(os.environ.get('STATUS_STREAM_TIMEOUT', '600'))
 
 # Define Models
 class ContactForm(BaseModel):
@@ -72,33 +518,1615 @@ PLANS = {
     "gold": {"amount": 250.0, "name": "Gold Plan"}
 }
 
+# Plan catalog
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+class PlanCatalog:
+    def __init__(self, plans: Dict[str, Dict]):
+        self._task = None
+        self._build(plans)
+
+    def _build(self, plans: Dict[str, Dict]):
+        # Serialize once; every GET /api/plans serves these exact bytes
+        catalog = {"plans": [{"id": plan_id, **plan} for plan_id, plan in plans.items()]}
+        self.plans = plans
+        self.body = json.dumps(catalog, separators=(",", ":"), sort_keys=True).encode()
+        self.etag = '"' + hashlib.sha256(self.body).hexdigest()[:32] + '"'
+
+    async def _read_source(self) -> Optional[Dict[str, Dict]]:
+        if plans_source == "file":
+            raw = await asyncio.to_thread(Path(plans_file).read_text)
+            return json.loads(raw)
+        if plans_source == "mongo":
+            docs = await db.plans.find().to_list(1000)
+            return {str(doc["_id"]): {"amount": doc["amount"], "name": doc["name"]} for doc in docs}
+        return None
+
+    async def load(self) -> bool:
+        try:
+            plans = await self._read_source()
+        except Exception as e:
+            logging.error(f"Plan catalog load error: {str(e)}")
+            return False
+        if not plans:
+            return False
+        for plan_id, plan in plans.items():
+            if not isinstance(plan.get("amount"), (int, float)) or plan["amount"] <= 0 or not plan.get("name"):
+                logging.error(f"Plan catalog load error: invalid plan {plan_id}")
+                return False
+
+        previous = self.etag
+        self._build({plan_id: {"amount": float(plan["amount"]), "name": plan["name"]} for plan_id, plan in plans.items()})
+        return self.etag != previous
+
+    def start(self, interval: float):
+        if plans_source != "static" and interval > 0:
+            self._task = asyncio.create_task(self._reload_periodically(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _reload_periodically(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            if await self.load():
+                logging.info(f"Plan catalog reloaded, etag {self.etag}")
+
+plan_catalog = PlanCatalog(PLANS)
+
+# Payment provider client
+class PaymentUnavailableError(Exception):
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+BREAKER_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.trips = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self._transition("half_open")
+        # Half open: a single probe decides whether the provider is back
+        if self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def end_probe(self):
+        self._probing = False
+
+    def record_success(self):
+        self.failures = 0
+        self._probing = False
+        if self.state != "closed":
+            self._transition("closed")
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+            self.opened_at = time.monotonic()
+            self.trips += 1
+            payment_breaker_trips.set(self.trips)
+            self._transition("open")
+            logging.error(f"Payment circuit breaker opened after {self.failures} failures")
+
+    def retry_after(self) -> float:
+        if self.state != "open":
+            return 1.0
+        return max(1.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def _transition(self, state: str):
+        self.state = state
+        payment_breaker_state.set(BREAKER_STATES[state])
+
+    def stats(self) -> Dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "trips": self.trips,
+            "retry_after": round(self.retry_after(), 1) if self.state == "open" else 0
+        }
+
+def is_client_error(error: Exception) -> bool:
+    # Stripe errors carry the HTTP status; a 4xx means the provider answered
+    http_status = getattr(error, "http_status", None)
+    return isinstance(http_status, int) and 400 <= http_status < 500
+
+def payment_unavailable(error: PaymentUnavailableError) -> HTTPException:
+    return HTTPException(status_code=503, detail=str(error), headers={"Retry-After": str(math.ceil(error.retry_after))})
+
+payment_breaker = CircuitBreaker(payment_breaker_threshold, payment_breaker_reset)
+
+PAYMENT_CHECKOUT_CACHE_SIZE = 8
+
+class PaymentClient:
+    def __init__(self, api_key: str, pool_size: int = 10, timeout: float = 30.0,
+                 call_timeout: float = 10.0, breaker: Optional[CircuitBreaker] = None):
+        self.api_key = api_key
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.call_timeout = call_timeout
+        self.breaker = breaker or CircuitBreaker()
+        self._checkouts: "OrderedDict[str, StripeCheckout]" = OrderedDict()
+        self._checkouts_lock = threading.Lock()
+        self._session = None
+        # Provider calls run on their own threads, one per pooled connection; a call waits
+        # for a free slot before its deadline starts
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="payment")
+        self._slots = asyncio.Semaphore(pool_size)
+
+    def _connect(self):
+        import requests
+        import stripe
+        from requests.adapters import HTTPAdapter
+
+        # Keep-alive connections toward the payment provider, shared by every request
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        self._session.mount("https://", adapter)
+        # The call deadline cannot interrupt a blocking request, so the socket timeout never outlives it
+        stripe.default_http_client = stripe.RequestsClient(timeout=min(self.timeout, self.call_timeout), session=self._session)
+
+    def _checkout(self, webhook_url: str = "") -> "StripeCheckout":
+        # Called on the worker threads: the first call imports the SDK, which must not block the loop.
+        # StripeCheckout binds the webhook URL at construction, so keep one per URL. The URL can
+        # follow the Host header when PUBLIC_BASE_URL is unset, so only a few are kept.
+        with self._checkouts_lock:
+            checkout = self._checkouts.get(webhook_url)
+            if checkout is None:
+                from emergentintegrations.payments.stripe.checkout import StripeCheckout
+
+                if self._session is None:
+                    self._connect()
+                checkout = StripeCheckout(api_key=self.api_key, webhook_url=webhook_url)
+                self._checkouts[webhook_url] = checkout
+                while len(self._checkouts) > PAYMENT_CHECKOUT_CACHE_SIZE:
+                    self._checkouts.popitem(last=False)
+            else:
+                self._checkouts.move_to_end(webhook_url)
+            return checkout
+
+    async def preload(self):
+        # Import the SDK and open the HTTP session ahead of the first payment request
+        await asyncio.wrap_future(self._executor.submit(self._checkout))
+
+    async def create_checkout_session(self, amount: float, currency: str, success_url: str,
+                                      cancel_url: str, metadata: Dict, webhook_url: str = "",
+                                      idempotency_key: Optional[str] = None) -> "CheckoutSessionResponse":
+        if idempotency_key:
+            # The checkout SDK has no idempotency option, so the key travels with the session metadata
+            metadata = {**metadata, "idempotency_key": idempotency_key}
+
+        def start():
+            from emergentintegrations.payments.stripe.checkout import CheckoutSessionRequest
+
+            checkout_request = CheckoutSessionRequest(
+                amount=amount,
+                currency=currency,
+                success_url=success_url,
+                cancel_url=cancel_url,
+                metadata=metadata
+            )
+            return self._checkout(webhook_url).create_checkout_session(checkout_request)
+
+        return await self._timed("create_checkout_session", start)
+
+    async def get_checkout_status(self, session_id: str) -> "CheckoutStatusResponse":
+        return await self._timed("get_checkout_status", lambda: self._checkout().get_checkout_status(session_id))
+
+    async def handle_webhook(self, body: bytes, signature: Optional[str]):
+        # Verification rejects forged payloads, so webhook failures must not open the breaker
+        return await self._timed("handle_webhook", lambda: self._checkout().handle_webhook(body, signature), guarded=False)
+
+    async def _timed(self, operation: str, start_call, guarded: bool = True):
+        # start_call builds the provider coroutine; it runs on the worker thread along with the call
+        if guarded and not self.breaker.allow():
+            raise PaymentUnavailableError("Payment provider unavailable", self.breaker.retry_after())
+
+        probing = guarded and self.breaker.state == "half_open"
+        # StripeCheckout's coroutines do blocking I/O through the requests client, so each
+        # call runs on its own loop in a worker thread and the event loop stays free. Waiting
+        # for a free worker is not the provider's fault, so the deadline starts once one is
+        # held; the slot is released when the thread finishes, even if the caller gave up.
+        try:
+            await self._slots.acquire()
+            try:
+                call = self._executor.submit(lambda: asyncio.run(start_call()))
+            except RuntimeError:
+                # The client was closed
+                self._slots.release()
+                raise
+        except BaseException:
+            if probing:
+                self.breaker.end_probe()
+            raise
+        call.add_done_callback(self._release_slot(asyncio.get_running_loop()))
+
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(call), self.call_timeout)
+            outcome = "success"
+            if guarded:
+                self.breaker.record_success()
+            return result
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            if guarded:
+                self.breaker.record_failure()
+            raise PaymentUnavailableError(f"Payment provider did not answer {operation} within {self.call_timeout}s")
+        except Exception as e:
+            if guarded:
+                if is_client_error(e):
+                    self.breaker.record_success()
+                else:
+                    self.breaker.record_failure()
+            raise
+        finally:
+            # A cancelled probe records nothing; let the next call probe instead
+            if probing:
+                self.breaker.end_probe()
+            payment_latency.observe(time.perf_counter() - start, operation, outcome)
+
+    def _release_slot(self, loop: asyncio.AbstractEventLoop):
+        def release(_):
+            try:
+                loop.call_soon_threadsafe(self._slots.release)
+            except RuntimeError:
+                # The loop has already closed
+                pass
+        return release
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._checkouts.clear()
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+# Checkout status cache
+def is_terminal_status(status: Optional[str], payment_status: Optional[str]) -> bool:
+    return payment_status == "paid" or status == "expired"
+
+class StatusCache:
+    def __init__(self, ttl: float, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: Dict[str, tuple] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return None
+        expires_at, payload = entry
+        if expires_at is not None and expires_at < time.monotonic():
+            self._entries.pop(session_id, None)
+            return None
+        return payload
+
+    def set(self, session_id: str, payload: Dict, terminal: bool = False):
+        # Terminal states never change again, so they do not expire
+        expires_at = None if terminal else time.monotonic() + self.ttl
+        self._entries.pop(session_id, None)
+        self._entries[session_id] = (expires_at, payload)
+        while len(self._entries) > self.max_entries:
+            self._entries.pop(next(iter(self._entries)))
+
+    def invalidate(self, session_id: str):
+        self._entries.pop(session_id, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def get_or_load(self, session_id: str, loader) -> Dict:
+        payload = self.get(session_id)
+        if payload is not None:
+            return payload
+
+        # Concurrent callers for the same session share a single load
+        future = self._inflight.get(session_id)
+        if future is None:
+            future = asyncio.ensure_future(self._load(session_id, loader))
+            self._inflight[session_id] = future
+            future.add_done_callback(lambda _: self._inflight.pop(session_id, None))
+        return await asyncio.shield(future)
+
+    async def _load(self, session_id: str, loader) -> Dict:
+        payload, terminal = await loader(session_id)
+        self.set(session_id, payload, terminal)
+        return payload
+
+status_cache = StatusCache(status_cache_ttl, max_entries=status_cache_size)
+
+class StatusBroker:
+    def __init__(self, source: str = "local"):
+        self.source = source
+        self._waiters: Dict[str, set] = {}
+        self._task = None
+
+    def subscribe(self, session_id: str) -> asyncio.Future:
+        # An idle stream is one pending future; nothing polls on its behalf
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(session_id, set()).add(waiter)
+        return waiter
+
+    def unsubscribe(self, session_id: str, waiter: asyncio.Future):
+        waiters = self._waiters.get(session_id)
+        if waiters is not None:
+            waiters.discard(waiter)
+            if not waiters:
+                del self._waiters[session_id]
+
+    def notify(self, session_id: str):
+        for waiter in self._waiters.pop(session_id, ()):
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def __len__(self):
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def start(self):
+        if self.source == "change_stream":
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _watch(self):
+        # Requires a replica set; picks up status changes written by any worker
+        pipeline = [
+            {"$match": {"operationType": {"$in": ["update", "replace"]}}},
+            {"$project": {"fullDocument.session_id": 1}}
+        ]
+        while True:
+            try:
+                async with db.payment_transactions.watch(pipeline, full_document="updateLookup") as stream:
+                    async for change in stream:
+                        session_id = (change.get("fullDocument") or {}).get("session_id")
+                        if session_id in self._waiters:
+                            status_cache.invalidate(session_id)
+                            self.notify(session_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Status change stream error: {str(e)}")
+                await asyncio.sleep(5)
+
+status_broker = StatusBroker(status_events_source)
+
+def status_changed(session_id: str):
+    status_cache.invalidate(session_id)
+    status_broker.notify(session_id)
+
+def transaction_status_payload(transaction: Dict) -> Dict:
+    # Rebuild the status response from a stored transaction
+    return {
+        "status": transaction.get("status"),
+        "payment_status": transaction.get("payment_status"),
+        "amount_total": transaction.get("amount_total", round(transaction["amount"] * 100)),
+        "currency": transaction.get("currency"),
+        "metadata": {
+            "plan_type": transaction.get("plan_type"),
+            "customer_email": transaction.get("customer_email") or "",
+            "plan_name": transaction.get("metadata", {}).get("plan_name", "")
+        }
+    }
+
+async def load_checkout_status(session_id: str):
+    transaction = await find_transaction(session_id)
+    if transaction and is_terminal_status(transaction.get("status"), transaction.get("payment_status")):
+        return transaction_status_payload(transaction), True
+
+    # Get status from Stripe
+    try:
+        status_response: CheckoutStatusResponse = await payment_client.get_checkout_status(session_id)
+    except PaymentUnavailableError:
+        if transaction is None:
+            raise
+        # Provider is down or slow: answer with the last status we recorded
+        return transaction_status_payload(transaction), False
+
+    # Update our database only when the status actually changed
+    if transaction and (
+        transaction.get("payment_status") != status_response.payment_status
+        or transaction.get("status") != status_response.status
+    ):
+        update_data = {
+            "payment_status": status_response.payment_status,
+            "status": status_response.status,
+            "amount_total": status_response.amount_total,
+            "updated_at": datetime.now(timezone.utc)
+        }
+
+        result = await db.payment_transactions.update_one(
+            {"session_id": session_id, "payment_status": transaction.get("payment_status")},
+            {"$set": update_data}
+        )
+        if result.modified_count and transaction.get("payment_status") != status_response.payment_status:
+            await apply_rollups(rollup_operations(transaction, transaction.get("payment_status"), status_response.payment_status))
+        if result.modified_count:
+            status_broker.notify(session_id)
+
+    payload = {
+        "status": status_response.status,
+        "payment_status": status_response.payment_status,
+        "amount_total": status_response.amount_total,
+        "currency": status_response.currency,
+        "metadata": status_response.metadata
+    }
+    return payload, is_terminal_status(status_response.status, status_response.payment_status)
+
+# Payment rollups: per (day, plan_type, payment_status) counts and amounts,
+# kept current as transactions change status
+def rollup_operations(transaction: Dict, old_status: Optional[str], new_status: Optional[str]) -> List[UpdateOne]:
+    day = transaction["created_at"].strftime("%Y-%m-%d")
+    plan_type = transaction.get("plan_type")
+    amount = transaction.get("amount", 0)
+    operations = []
+    for status, sign in ((old_status, -1), (new_status, 1)):
+        if status is None:
+            continue
+        operations.append(UpdateOne(
+            {"_id": f"{day}|{plan_type}|{status}"},
+            {
+                "$inc": {"count": sign, "amount": sign * amount},
+                "$setOnInsert": {"day": day, "plan_type": plan_type, "payment_status": status}
+            },
+            upsert=True
+        ))
+    return operations
+
+async def apply_rollups(operations: List[UpdateOne]):
+    # Rollups can drift if this fails; rebuild_payment_rollups() recomputes them
+    if not operations:
+        return
+    try:
+        await db.payment_rollups.bulk_write(operations, ordered=False)
+    except Exception as e:
+        logging.error(f"Payment rollup error: {str(e)}")
+
+async def write_status_changes(changes: List[Tuple[Dict, Dict, Dict]]) -> Tuple[List[Tuple[Dict, Dict, Dict]], List[UpdateOne]]:
+    # changes are (transaction as read, conditional filter, fields to set). Each write is
+    # tagged so that rows another writer moved first are left out of the returned changes
+    # and the rollups.
+    if not changes:
+        return [], []
+    change_id = str(uuid.uuid4())
+    result = await db.payment_transactions.bulk_write([
+        UpdateOne(filter, {"$set": {**fields, "change_id": change_id}}) for _, filter, fields in changes
+    ], ordered=False)
+
+    applied = changes
+    if result.modified_count < len(changes):
+        matched = await db.payment_transactions.find(
+            {"session_id": {"$in": [transaction["session_id"] for transaction, _, _ in changes]}, "change_id": change_id},
+            {"_id": 0, "session_id": 1}
+        ).to_list(None)
+        matched_ids = {doc["session_id"] for doc in matched}
+        applied = [change for change in changes if change[0]["session_id"] in matched_ids]
+
+    rollups = []
+    for transaction, _, fields in applied:
+        old_status = transaction.get("payment_status")
+        if "payment_status" in fields and fields["payment_status"] != old_status:
+            rollups.extend(rollup_operations(transaction, old_status, fields["payment_status"]))
+    return applied, rollups
+
+async def rebuild_payment_rollups():
+    pipeline = [
+        {"$group": {
+            "_id": {
+                "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}},
+                "plan_type": "$plan_type",
+                "payment_status": "$payment_status"
+            },
+            "count": {"$sum": 1},
+            "amount": {"$sum": "$amount"}
+        }},
+        {"$project": {
+            "_id": {"$concat": [
+                "$_id.day", "|",
+                {"$ifNull": ["$_id.plan_type", "None"]}, "|",
+                {"$ifNull": ["$_id.payment_status", "None"]}
+            ]},
+            "day": "$_id.day",
+            "plan_type": "$_id.plan_type",
+            "payment_status": "$_id.payment_status",
+            "count": 1,
+            "amount": 1
+        }},
+        {"$out": "payment_rollups"}
+    ]
+    # Archived transactions still count towards the stats
+    if await db.payment_transactions_archive.estimated_document_count():
+        pipeline.insert(0, {"$unionWith": {"coll": "payment_transactions_archive"}})
+    await db.payment_transactions.aggregate(pipeline).to_list(None)
+
+    if archive_dir.exists():
+        totals = await asyncio.to_thread(archived_rollup_totals)
+        await apply_rollups([
+            UpdateOne(
+                {"_id": f"{day}|{plan_type}|{status}"},
+                {
+                    "$inc": {"count": count, "amount": amount},
+                    "$setOnInsert": {"day": day, "plan_type": plan_type, "payment_status": status}
+                },
+                upsert=True
+            )
+            for (day, plan_type, status), (count, amount) in totals.items()
+        ])
+
+def archived_rollup_totals() -> Dict[Tuple, List]:
+    # Same grouping as the rebuild pipeline, over transactions archived to segment files
+    totals = {}
+    for path in sorted(archive_dir.glob("payment_transactions-*.jsonl.gz")):
+        with gzip_module.open(path, "rb") as f:
+            for line in f:
+                doc = orjson.loads(line)
+                key = (doc["created_at"][:10], doc.get("plan_type"), doc.get("payment_status"))
+                entry = totals.setdefault(key, [0, 0])
+                entry[0] += 1
+                entry[1] += doc.get("amount", 0)
+    return totals
+
+# Webhook ingestion
+class WebhookProcessor:
+    def __init__(self, workers: int = 2, batch_size: int = 100, max_attempts: int = 8,
+                 backoff: float = 1.0, poll_interval: float = 1.0, lease: float = 60.0):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.applied_total = 0
+        self.failed_batches = 0
+        self.last_lag_seconds = 0.0
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+
+    def start(self):
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        self._wakeup.set()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                events = await self._claim_batch()
+            except Exception as e:
+                logging.error(f"Webhook claim error: {str(e)}")
+                events = []
+            if events:
+                await self._apply(events)
+                continue
+
+            # Nothing due: sleep until a new event arrives or retries come due
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _claim_batch(self) -> List[Dict]:
+        now = datetime.now(timezone.utc)
+        due = {"$or": [
+            {"state": "pending", "next_attempt_at": {"$lte": now}},
+            {"state": "processing", "claimed_at": {"$lt": now - timedelta(seconds=self.lease)}}
+        ]}
+        candidates = await db.webhook_events.find(due, {"_id": 1}).sort("received_at", 1).limit(self.batch_size).to_list(self.batch_size)
+        if not candidates:
+            return []
+
+        # Claim atomically per event so concurrent workers never share one
+        claim = str(uuid.uuid4())
+        ids = [event["_id"] for event in candidates]
+        await db.webhook_events.update_many(
+            {"_id": {"$in": ids}, **due},
+            {"$set": {"state": "processing", "claim": claim, "claimed_at": now}}
+        )
+        # Re-read through _id so the lookup stays on the primary key
+        return await db.webhook_events.find({"_id": {"$in": ids}, "claim": claim}).sort("received_at", 1).to_list(self.batch_size)
+
+    async def _apply(self, events: List[Dict]):
+        # Only the latest event per session matters within a batch
+        latest = {}
+        for event in events:
+            if event.get("session_id"):
+                latest[event["session_id"]] = event
+
+        now = datetime.now(timezone.utc)
+        changes = []
+        try:
+            transactions = await db.payment_transactions.find(
+                {"session_id": {"$in": list(latest)}},
+                {"_id": 0, "session_id": 1, "payment_status": 1, "plan_type": 1, "amount": 1, "created_at": 1}
+            ).to_list(None)
+            for transaction in transactions:
+                old_status = transaction.get("payment_status")
+                new_status = latest[transaction["session_id"]]["payment_status"]
+                # A paid transaction is final; a late or out-of-order event never reverts it
+                if old_status == new_status or old_status == "paid":
+                    continue
+                changes.append((
+                    transaction,
+                    {"session_id": transaction["session_id"], "payment_status": old_status},
+                    {"payment_status": new_status, "updated_at": now}
+                ))
+
+            applied, rollups = await write_status_changes(changes)
+            await db.webhook_events.update_many(
+                {"_id": {"$in": [event["_id"] for event in events]}},
+                {"$set": {"state": "applied", "applied_at": now}, "$unset": {"claim": ""}}
+            )
+        except Exception as e:
+            logging.error(f"Webhook apply error: {str(e)}")
+            self.failed_batches += 1
+            await self._retry(events, str(e))
+            return
+
+        await apply_rollups(rollups)
+        for transaction, _, _ in applied:
+            status_changed(transaction["session_id"])
+        self.applied_total += len(events)
+        oldest = min(event["received_at"] for event in events)
+        self.last_lag_seconds = now.timestamp() - oldest.replace(tzinfo=timezone.utc).timestamp()
+
+    async def _retry(self, events: List[Dict], error: str):
+        now = datetime.now(timezone.utc)
+        for event in events:
+            attempts = event.get("attempts", 0) + 1
+            delay = self.backoff * (2 ** (attempts - 1))
+            update = {
+                "state": "failed" if attempts >= self.max_attempts else "pending",
+                "attempts": attempts,
+                "last_error": error,
+                "next_attempt_at": now + timedelta(seconds=delay)
+            }
+            try:
+                await db.webhook_events.update_one({"_id": event["_id"]}, {"$set": update, "$unset": {"claim": ""}})
+            except Exception as e:
+                logging.error(f"Webhook retry scheduling error: {str(e)}")
+
+    async def stats(self) -> Dict:
+        oldest = await db.webhook_events.find_one({"state": {"$in": ["pending", "processing"]}}, sort=[("received_at", 1)])
+        lag = 0.0
+        if oldest:
+            lag = time.time() - oldest["received_at"].replace(tzinfo=timezone.utc).timestamp()
+        return {
+            "pending": await db.webhook_events.count_documents({"state": {"$in": ["pending", "processing"]}}),
+            "failed": await db.webhook_events.count_documents({"state": "failed"}),
+            "lag_seconds": max(lag, 0.0),
+            "last_batch_lag_seconds": self.last_lag_seconds,
+            "applied_total": self.applied_total,
+            "failed_batches": self.failed_batches
+        }
+
+webhook_processor = WebhookProcessor(webhook_workers, batch_size=webhook_batch_size, max_attempts=webhook_max_attempts)
+
+# Idempotent checkout session creation
+class IdempotencyStore:
+    def __init__(self, ttl: int, lease: float = 20.0, wait_timeout: float = 30.0, poll_interval: float = 0.1):
+        self.ttl = ttl
+        self.lease = lease
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def run(self, key: str, fingerprint: str, create) -> Dict:
+        # Duplicates arriving at this worker wait on the in-flight result
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._run(key, fingerprint, create))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        result = await asyncio.shield(future)
+        if result["fingerprint"] != fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used with different parameters")
+        return result["response"]
+
+    async def _run(self, key: str, fingerprint: str, create) -> Dict:
+        now = datetime.now(timezone.utc)
+        owner = str(uuid.uuid4())
+        await db.idempotency_keys.delete_one({"_id": key, "created_at": {"$lt": now - timedelta(seconds=self.ttl)}})
+        if not await self._claim(key, fingerprint, owner):
+            # Another request (possibly on another worker) owns the key
+            result = await self._wait(key, fingerprint, owner)
+            if result is not None:
+                return result
+
+        try:
+            response = await create()
+        except Exception:
+            await db.idempotency_keys.delete_one({"_id": key, "state": "in_progress", "owner": owner})
+            raise
+        try:
+            await db.idempotency_keys.update_one(
+                {"_id": key, "owner": owner},
+                {"$set": {"state": "completed", "response": response}, "$unset": {"locked_until": ""}}
+            )
+        except Exception as e:
+            # The session exists, so answer with it; retries take the key over once the lease lapses
+            logging.error(f"Idempotency record error: {str(e)}")
+        return {"fingerprint": fingerprint, "response": response}
+
+    async def _claim(self, key: str, fingerprint: str, owner: str) -> bool:
+        now = datetime.now(timezone.utc)
+        try:
+            await db.idempotency_keys.insert_one({
+                "_id": key,
+                "state": "in_progress",
+                "fingerprint": fingerprint,
+                "owner": owner,
+                "locked_until": now + timedelta(seconds=self.lease),
+                "created_at": now
+            })
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def _wait(self, key: str, fingerprint: str, owner: str) -> Optional[Dict]:
+        # Returns the stored result, or None once this request owns the key
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            record = await db.idempotency_keys.find_one({"_id": key})
+            if record is None:
+                # The owner failed and released the key
+                if await self._claim(key, fingerprint, owner):
+                    return None
+                continue
+            if record["fingerprint"] != fingerprint or record["state"] == "completed":
+                return {"fingerprint": record["fingerprint"], "response": record.get("response")}
+
+            now = datetime.now(timezone.utc)
+            locked_until = record.get("locked_until") or record["created_at"] + timedelta(seconds=self.lease)
+            if locked_until.replace(tzinfo=timezone.utc) < now:
+                # The owner died mid-request; take the key over
+                result = await db.idempotency_keys.update_one(
+                    {"_id": key, "state": "in_progress", "owner": record["owner"]},
+                    {"$set": {"owner": owner, "locked_until": now + timedelta(seconds=self.lease)}}
+                )
+                if result.modified_count:
+                    return None
+                continue
+            await asyncio.sleep(self.poll_interval)
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+
+idempotency_store = IdempotencyStore(idempotency_ttl, lease=idempotency_lease)
+
+def checkout_fingerprint(checkout_data: CheckoutRequest) -> str:
+    raw = json.dumps(checkout_data.dict(), sort_keys=True)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+# Reconciliation sweeper
+async def acquire_lease(name: str, seconds: float, owner: str) -> bool:
+    # Cross-worker lease so only one process sweeps at a time
+    now = datetime.now(timezone.utc)
+    try:
+        await db.leases.update_one(
+            {"_id": name, "$or": [{"expires_at": {"$lt": now}}, {"owner": owner}]},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=seconds)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+class AsyncRateLimiter:
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+class ReconciliationSweeper:
+    def __init__(self, interval: float, min_age: float, batch_size: int = 100,
+                 concurrency: int = 4, rate: float = 10.0):
+        self.interval = interval
+        self.min_age = min_age
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.rate = rate
+        self.owner = str(uuid.uuid4())
+        self.last_run: Optional[Dict] = None
+        self._task = None
+        self._sweeping = False
+
+    def start(self):
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                logging.error(f"Reconciliation sweep error: {str(e)}")
+
+    async def run_once(self) -> Optional[Dict]:
+        # None when a sweep is already running here or another worker holds the lease
+        if self._sweeping or not await acquire_lease("reconciliation_sweeper", self.interval or 300, self.owner):
+            return None
+        self._sweeping = True
+        try:
+            return await self.sweep()
+        finally:
+            self._sweeping = False
+
+    async def sweep(self, client=None) -> Dict:
+        client = client or payment_client
+        semaphore = asyncio.Semaphore(self.concurrency)
+        limiter = AsyncRateLimiter(self.rate)
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.min_age)
+        stats = {"checked": 0, "updated": 0, "errors": 0, "started_at": datetime.now(timezone.utc)}
+
+        async def check(transaction: Dict):
+            async with semaphore:
+                await limiter.acquire()
+                try:
+                    return transaction, await client.get_checkout_status(transaction["session_id"])
+                except Exception as e:
+                    logging.error(f"Reconciliation lookup error for {transaction['session_id']}: {str(e)}")
+                    stats["errors"] += 1
+                    return transaction, None
+
+        # Walk pending transactions oldest first on the (status, created_at, id) index
+        pending = {"status": {"$in": ["initiated", "open"]}, "payment_status": {"$ne": "paid"}, "created_at": {"$lt": cutoff}}
+        query = pending
+        while True:
+            batch = await db.payment_transactions.find(query).sort([("created_at", 1), ("id", 1)]).limit(self.batch_size).to_list(self.batch_size)
+            if not batch:
+                break
+            results = await asyncio.gather(*[check(transaction) for transaction in batch])
+            stats["checked"] += len(batch)
+
+            now = datetime.now(timezone.utc)
+            changes = []
+            for transaction, status_response in results:
+                if status_response is None:
+                    continue
+                if (transaction.get("payment_status"), transaction.get("status")) == (status_response.payment_status, status_response.status):
+                    continue
+                changes.append((
+                    transaction,
+                    {"session_id": transaction["session_id"], "payment_status": transaction.get("payment_status"), "status": transaction.get("status")},
+                    {
+                        "payment_status": status_response.payment_status,
+                        "status": status_response.status,
+                        "amount_total": status_response.amount_total,
+                        "updated_at": now
+                    }
+                ))
+
+            if changes:
+                applied, rollups = await write_status_changes(changes)
+                stats["updated"] += len(applied)
+                await apply_rollups(rollups)
+                # Only wake streams whose transaction this sweep actually moved
+                for transaction, _, _ in applied:
+                    status_changed(transaction["session_id"])
+
+            if len(batch) < self.batch_size:
+                break
+            # Continue after the last (created_at, id) seen, whether or not it changed;
+            # transactions sharing a timestamp are told apart by id
+            last = batch[-1]
+            query = {**pending, "$or": [
+                {"created_at": {"$gt": last["created_at"]}},
+                {"created_at": last["created_at"], "id": {"$gt": last["id"]}}
+            ]}
+
+        stats["finished_at"] = datetime.now(timezone.utc)
+        self.last_run = stats
+        return stats
+
+reconciliation_sweeper = ReconciliationSweeper(
+    sweep_interval, sweep_min_age,
+    batch_size=sweep_batch_size, concurrency=sweep_concurrency, rate=sweep_rate
+)
+
+# Rate limiting and load shedding
+def parse_rate(rate: str) -> Tuple[int, float]:
+    requests_allowed, seconds = rate.split("/")
+    return int(requests_allowed), float(seconds)
+
+class TokenBucketLimiter:
+    def __init__(self, capacity: int, period: float, max_keys: int = 100000):
+        self.capacity = capacity
+        self.refill_rate = capacity / period
+        self.idle_after = period
+        self.max_keys = max_keys
+        # key -> (tokens, last refill time), least recently used first
+        self._buckets: OrderedDict = OrderedDict()
+
+    async def take(self, key: str) -> Tuple[bool, float]:
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - updated) * self.refill_rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[key] = (tokens, now)
+        self._evict(now)
+        retry_after = 0.0 if allowed else (1 - tokens) / self.refill_rate
+        return allowed, retry_after
+
+    def _evict(self, now: float):
+        # Buckets idle for a full period have refilled, so dropping them loses nothing
+        while self._buckets:
+            key, (_, updated) = next(iter(self._buckets.items()))
+            if len(self._buckets) <= self.max_keys and now - updated < self.idle_after:
+                break
+            self._buckets.popitem(last=False)
+
+class MongoWindowLimiter:
+    def __init__(self, scope: str, capacity: int, period: float):
+        self.scope = scope
+        self.capacity = capacity
+        self.period = period
+
+    async def take(self, key: str) -> Tuple[bool, float]:
+        # Fixed window counter shared by every worker; the TTL index removes old windows
+        now = time.time()
+        window = int(now // self.period)
+        window_end = (window + 1) * self.period
+        counter = await db.rate_limits.find_one_and_update(
+            {"_id": f"{self.scope}:{key}:{window}"},
+            {"$inc": {"count": 1}, "$setOnInsert": {"expires_at": datetime.fromtimestamp(window_end, timezone.utc)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if counter["count"] <= self.capacity:
+            return True, 0.0
+        return False, window_end - now
+
+def build_limiter(scope: str, rate: str):
+    capacity, period = parse_rate(rate)
+    if rate_limit_backend == "mongo":
+        return MongoWindowLimiter(scope, capacity, period)
+    return TokenBucketLimiter(capacity, period, max_keys=rate_limit_max_keys)
+
+rate_limiters = {
+    "contact": build_limiter("contact", rate_limit_contact),
+    "checkout": build_limiter("checkout", rate_limit_checkout)
+}
+
+def client_ip(request: Request) -> str:
+    # Behind the ingress the peer address is the proxy. Clients can put anything in
+    # X-Forwarded-For, so only the hop appended by our own outermost proxy is trusted.
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded and trusted_proxy_count > 0:
+        hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+        if len(hops) >= trusted_proxy_count:
+            return hops[-trusted_proxy_count]
+    return request.client.host if request.client else "unknown"
+
+async def enforce_rate_limit(request: Request, scope: str, email: Optional[str] = None):
+    if not rate_limit_enabled:
+        return
+    keys = [f"ip:{client_ip(request)}"]
+    if email:
+        keys.append(f"email:{email.strip().lower()}")
+    for key in keys:
+        allowed, retry_after = await rate_limiters[scope].take(key)
+        if not allowed:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests",
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+            )
+
+class LoadShedder:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self.shed_total = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        # Refuse work up front instead of queueing it behind a saturated Motor pool
+        if self.in_flight >= self.limit:
+            self.shed_total += 1
+            raise HTTPException(status_code=503, detail="Server busy", headers={"Retry-After": "1"})
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+
+write_shedder = LoadShedder(max_concurrent_writes)
+
+# Admin authentication
+async def require_admin(request: Request):
+    if not admin_api_key:
+        raise HTTPException(status_code=403, detail="Admin API is disabled")
+    provided = request.headers.get("x-admin-key", "")
+    if not hmac.compare_digest(provided.encode(), admin_api_key.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin key")
+
+# Contact write buffer
+class ContactWriteBuffer:
+    def __init__(self, max_docs: int = 50, window: float = 0.02):
+        self.max_docs = max_docs
+        self.window = window
+        self._pending: List[tuple] = []
+        self._timer = None
+        self._writes = set()
+
+    async def submit(self, doc: Dict, wait: bool = True):
+        future = asyncio.get_running_loop().create_future() if wait else None
+        self._pending.append((doc, future))
+        if len(self._pending) >= self.max_docs:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+        if future is not None:
+            await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = asyncio.create_task(self._write(batch))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    async def _write(self, batch: List[tuple]):
+        errors = {}
+        try:
+            await db.contact_forms.insert_many([doc for doc, _ in batch], ordered=False)
+        except BulkWriteError as e:
+            # Unordered inserts still write every document that did not fail
+            for error in e.details.get("writeErrors", []):
+                errors[error["index"]] = Exception(error.get("errmsg", "Contact insert failed"))
+        except Exception as e:
+            errors = {index: e for index in range(len(batch))}
+
+        if errors:
+            logging.error(f"Contact batch insert error: {len(errors)} of {len(batch)} documents failed")
+        for index, (_, future) in enumerate(batch):
+            if future is None or future.done():
+                continue
+            if index in errors:
+                future.set_exception(errors[index])
+            else:
+                future.set_result(None)
+
+    async def drain(self):
+        self._flush()
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+
+contact_buffer = ContactWriteBuffer(contact_buffer_size, window=contact_buffer_window)
+
+# Contact listing
+CONTACT_PAGE_SIZE = 100
+CONTACT_PAGE_MAX = 1000
+CONTACT_STREAM_BATCH = 500
+CONTACT_SORT = [("created_at", 1), ("id", 1)]
+
+def encode_cursor(created_at: datetime, doc_id: str) -> str:
+    raw = json.dumps([created_at.isoformat(), doc_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, doc_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), str(doc_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset_filter(cursor: Optional[str]) -> Dict:
+    # Resume strictly after the (created_at, id) pair encoded in the cursor
+    if not cursor:
+        return {}
+    created_at, doc_id = decode_cursor(cursor)
+    return {"$or": [
+        {"created_at": {"$gt": created_at}},
+        {"created_at": created_at, "id": {"$gt": doc_id}}
+    ]}
+
+CONTACT_SEARCH_COUNT_CAP = 1000
+CONTACT_PROJECTION = {"_id": 0, "id": 1, "name": 1, "email": 1, "phone": 1, "service": 1, "message": 1, "created_at": 1}
+
+def dump_json(value) -> bytes:
+    # Mongo hands back naive UTC datetimes; orjson tags them as UTC
+    return orjson.dumps(value, option=orjson.OPT_NAIVE_UTC)
+
+async def stream_ndjson(cursor, chunk_size: int = 100):
+    # Serialize documents as the Motor cursor yields them, a few at a time
+    lines = []
+    try:
+        async for doc in cursor:
+            lines.append(dump_json(doc))
+            if len(lines) >= chunk_size:
+                yield b"\n".join(lines) + b"\n"
+                lines = []
+        if lines:
+            yield b"\n".join(lines) + b"\n"
+    except Exception as e:
+        logging.error(f"NDJSON stream error: {str(e)}")
+        raise
+
+# Transaction archival
+TERMINAL_TRANSACTION_FILTER = {"$or": [{"payment_status": "paid"}, {"status": "expired"}]}
+
+def read_archived_transaction(segment: str, session_id: str) -> Optional[Dict]:
+    with gzip_module.open(archive_dir / segment, "rb") as f:
+        for line in f:
+            doc = orjson.loads(line)
+            if doc.get("session_id") == session_id:
+                for field in ("created_at", "updated_at"):
+                    if doc.get(field):
+                        doc[field] = datetime.fromisoformat(doc[field])
+                return doc
+    return None
+
+def write_archive_segment(path: Path, docs: List[Dict]):
+    # Write then rename so a crash never leaves a partial segment behind
+    temp_path = path.with_suffix(".tmp")
+    with gzip_module.open(temp_path, "wb") as f:
+        for doc in docs:
+            f.write(dump_json(doc) + b"\n")
+    temp_path.replace(path)
+
+async def find_transaction(session_id: str) -> Optional[Dict]:
+    transaction = await db.payment_transactions.find_one({"session_id": session_id})
+    if transaction is not None or transaction_archive_days <= 0:
+        return transaction
+
+    # Fall back to the archive for transactions that have been rolled over
+    if archive_target == "files":
+        entry = await db.payment_transactions_archive_index.find_one({"session_id": session_id})
+        if entry is None:
+            return None
+        return await asyncio.to_thread(read_archived_transaction, entry["segment"], session_id)
+    return await db.payment_transactions_archive.find_one({"session_id": session_id})
+
+class TransactionArchiver:
+    def __init__(self, days: int, target: str = "collection", batch_size: int = 500, interval: float = 3600):
+        self.days = days
+        self.target = target
+        self.batch_size = batch_size
+        self.interval = interval
+        self.owner = str(uuid.uuid4())
+        self._task = None
+
+    def start(self):
+        if self.days > 0 and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                if await acquire_lease("transaction_archiver", self.interval, self.owner):
+                    await self.archive()
+            except Exception as e:
+                logging.error(f"Transaction archival error: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    async def archive(self) -> Dict:
+        checkpoint = await db.archive_checkpoints.find_one({"_id": "payment_transactions"}) or {}
+        # Finish a batch that was copied but not yet removed before the last stop
+        if checkpoint.get("pending_ids"):
+            await db.payment_transactions.delete_many({"_id": {"$in": checkpoint["pending_ids"]}})
+            await db.archive_checkpoints.update_one({"_id": "payment_transactions"}, {"$unset": {"pending_ids": ""}})
+
+        segment = checkpoint.get("segment", 0)
+        cutoff = datetime.now(timezone.utc) - timedelta(days=self.days)
+        query = {**TERMINAL_TRANSACTION_FILTER, "created_at": {"$lt": cutoff}}
+        archived = 0
+        while True:
+            batch = await db.payment_transactions.find(query).sort([("created_at", 1), ("id", 1)]).limit(self.batch_size).to_list(self.batch_size)
+            if not batch:
+                break
+
+            if self.target == "files":
+                segment += 1
+                name = f"payment_transactions-{segment:08d}.jsonl.gz"
+                archive_dir.mkdir(parents=True, exist_ok=True)
+                await asyncio.to_thread(write_archive_segment, archive_dir / name, [
+                    {key: value for key, value in doc.items() if key != "_id"} for doc in batch
+                ])
+                await db.payment_transactions_archive_index.insert_many([
+                    {"session_id": doc["session_id"], "segment": name} for doc in batch
+                ])
+            else:
+                try:
+                    await db.payment_transactions_archive.insert_many(batch, ordered=False)
+                except BulkWriteError as e:
+                    # Documents already copied by an interrupted run are fine
+                    if any(error["code"] != 11000 for error in e.details.get("writeErrors", [])):
+                        raise
+
+            ids = [doc["_id"] for doc in batch]
+            last = batch[-1]
+            await db.archive_checkpoints.update_one(
+                {"_id": "payment_transactions"},
+                {"$set": {
+                    "segment": segment,
+                    "last_created_at": last["created_at"],
+                    "last_id": last.get("id"),
+                    "pending_ids": ids,
+                    "updated_at": datetime.now(timezone.utc)
+                }},
+                upsert=True
+            )
+            await db.payment_transactions.delete_many({"_id": {"$in": ids}})
+            await db.archive_checkpoints.update_one({"_id": "payment_transactions"}, {"$unset": {"pending_ids": ""}})
+            archived += len(batch)
+
+        return {"archived": archived, "target": self.target, "segment": segment}
+
+transaction_archiver = TransactionArchiver(
+    transaction_archive_days, archive_target,
+    batch_size=archive_batch_size, interval=archive_interval
+)
+
+# Exports
+CONTACT_EXPORT_FIELDS = ["id", "name", "email", "phone", "service", "message", "created_at"]
+TRANSACTION_EXPORT_FIELDS = [
+    "id", "session_id", "amount", "currency", "plan_type", "customer_email",
+    "payment_status", "status", "created_at", "updated_at"
+]
+EXPORTS = {
+    "contacts": ("contact_forms", CONTACT_EXPORT_FIELDS, CONTACT_SORT),
+    "transactions": ("payment_transactions", TRANSACTION_EXPORT_FIELDS, None),
+}
+
+CSV_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+def csv_cell(value):
+    # Mongo hands back naive UTC datetimes; tag them the same way as the JSON output
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=value.tzinfo or timezone.utc).isoformat()
+    # Form input opened in a spreadsheet must not be evaluated as a formula
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+async def stream_csv(cursor, fields: List[str], chunk_size: int = 500):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    rows = 0
+    async for doc in cursor:
+        writer.writerow([csv_cell(doc.get(field)) for field in fields])
+        rows += 1
+        if rows >= chunk_size:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+            rows = 0
+    yield buffer.getvalue().encode()
+
+async def gzip_stream(chunks):
+    # Compress on the fly; memory stays at one chunk plus the deflate window
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+# MongoDB indexes, created at startup
+INDEXES = {
+    "contact_forms": [
+        ([("created_at", 1), ("id", 1)], {"name": "created_at_id"}),
+        ([("service", 1), ("created_at", 1), ("id", 1)], {"name": "service_created_at_id"}),
+        ([("email", 1), ("created_at", 1), ("id", 1)], {"name": "email_created_at_id"}),
+        ([("name", "text"), ("message", "text")], {"name": "name_message_text"}),
+    ],
+    "payment_transactions": [
+        ([("session_id", 1)], {"name": "session_id_unique", "unique": True}),
+        ([("status", 1), ("created_at", 1), ("id", 1)], {"name": "status_created_at_id"}),
+        ([("created_at", 1), ("id", 1)], {"name": "created_at_id"}),
+    ],
+    "payment_transactions_archive": [
+        ([("session_id", 1)], {"name": "session_id_unique", "unique": True}),
+    ],
+    "payment_transactions_archive_index": [
+        ([("session_id", 1)], {"name": "session_id"}),
+    ],
+    "payment_rollups": [
+        ([("day", 1)], {"name": "day"}),
+    ],
+    "rate_limits": [
+        ([("expires_at", 1)], {"name": "expires_at_ttl", "expireAfterSeconds": 0}),
+    ],
+    "idempotency_keys": [
+        ([("created_at", 1)], {"name": "created_at_ttl", "expireAfterSeconds": idempotency_ttl}),
+    ],
+    "webhook_events": [
+        ([("state", 1), ("next_attempt_at", 1)], {"name": "state_next_attempt_at"}),
+        ([("state", 1), ("received_at", 1)], {"name": "state_received_at"}),
+        ([("applied_at", 1)], {
+            "name": "applied_at_ttl",
+            "expireAfterSeconds": webhook_event_retention,
+            "partialFilterExpression": {"state": "applied"}
+        }),
+    ],
+}
+
+if contact_retention_days > 0:
+    # TTL indexes must be single-field, so this sits alongside the (created_at, id) index
+    INDEXES["contact_forms"].append(
+        ([("created_at", 1)], {"name": "created_at_ttl", "expireAfterSeconds": contact_retention_days * 86400})
+    )
+
+# Hot queries checked by the query plan report: (collection, filter, sort)
+HOT_QUERIES = {
+    "contact_list": ("contact_forms", {}, CONTACT_SORT),
+    "contact_search_by_service": ("contact_forms", {"service": "plan-probe"}, CONTACT_SORT),
+    "contact_search_by_email": ("contact_forms", {"email": "plan-probe"}, CONTACT_SORT),
+    "transaction_by_session": ("payment_transactions", {"session_id": "plan-probe"}, None),
+    "stale_pending_transactions": ("payment_transactions", {"status": {"$in": ["initiated", "open"]}, "payment_status": {"$ne": "paid"}, "created_at": {"$lt": datetime(2000, 1, 1)}}, [("created_at", 1), ("id", 1)]),
+}
+
+async def ensure_indexes():
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                await db[collection].create_index(keys, **options)
+            except OperationFailure as e:
+                # IndexOptionsConflict: a changed TTL is applied in place instead of rebuilding
+                if e.code == 85 and "expireAfterSeconds" in options:
+                    await db.command("collMod", collection, index={
+                        "name": options["name"],
+                        "expireAfterSeconds": options["expireAfterSeconds"]
+                    })
+                else:
+                    logging.error(f"Index creation error on {collection}.{options['name']}: {str(e)}")
+            except Exception as e:
+                logging.error(f"Index creation error on {collection}.{options['name']}: {str(e)}")
+
+    if contact_retention_days <= 0:
+        # Turning retention off has to stop expiry, not just stop creating the index
+        try:
+            if "created_at_ttl" in await db.contact_forms.index_information():
+                await db.contact_forms.drop_index("created_at_ttl")
+        except Exception as e:
+            logging.error(f"Index drop error on contact_forms.created_at_ttl: {str(e)}")
+
+def plan_stages(plan: Dict) -> List[Dict]:
+    # Flatten a winning plan tree into its stages, outermost first
+    stages = []
+    pending = [plan.get("queryPlan", plan)]
+    while pending:
+        stage = pending.pop(0)
+        stages.append({"stage": stage.get("stage"), "index": stage.get("indexName")})
+        if "inputStage" in stage:
+            pending.append(stage["inputStage"])
+        pending.extend(stage.get("inputStages", []))
+    return stages
+
 # Routes
 @api_router.get("/")
 async def root():
     return {"message": "Web X Media API"}
 
 @api_router.post("/contact")
-async def submit_contact_form(form_data: ContactFormCreate):
+async def submit_contact_form(request: Request, form_data: ContactFormCreate):
+    await enforce_rate_limit(request, "contact", form_data.email)
+    async with write_shedder.slot():
+        return await save_contact_form(form_data)
+
+async def save_contact_form(form_data: ContactFormCreate):
     try:
         contact = ContactForm(**form_data.dict())
-        await db.contact_forms.insert_one(contact.dict())
+        if contact_write_mode == "direct":
+            await db.contact_forms.insert_one(contact.dict())
+        else:
+            await contact_buffer.submit(contact.dict(), wait=contact_write_mode == "flush")
         return {"success": True, "message": "Contact form submitted successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.get("/contact")
-async def get_contact_forms():
+async def get_contact_forms(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=CONTACT_PAGE_MAX),
+    cursor: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$")
+):
+    query = keyset_filter(cursor)
+    try:
+        if format == "ndjson":
+            # Stream everything after the cursor unless a limit was asked for
+            contacts = db.contact_forms.find(query, CONTACT_PROJECTION).sort(CONTACT_SORT).batch_size(CONTACT_STREAM_BATCH)
+            if limit:
+                contacts = contacts.limit(limit)
+            return StreamingResponse(stream_ndjson(contacts), media_type="application/x-ndjson")
+
+        page_size = limit or CONTACT_PAGE_SIZE
+        # Submissions are only ever added or expired, so the newest key plus the count
+        # identify the collection state without reading the page
+        newest = await db.contact_forms.find({}, {"_id": 0, "created_at": 1, "id": 1}).sort(
+            [("created_at", -1), ("id", -1)]
+        ).limit(1).to_list(1)
+        count = await db.contact_forms.estimated_document_count()
+        last_key = (newest[0]["created_at"], newest[0]["id"]) if newest else ()
+        etag = make_etag(page_size, cursor, count, *last_key)
+        headers = {"ETag": etag}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+
+        # Fetch one extra document to know whether another page exists
+        contacts = await db.contact_forms.find(query, CONTACT_PROJECTION).sort(CONTACT_SORT).limit(page_size + 1).to_list(page_size + 1)
+        if len(contacts) > page_size:
+            contacts = contacts[:page_size]
+            last = contacts[-1]
+            headers["X-Next-Cursor"] = encode_cursor(last["created_at"], last["id"])
+        # Documents are already in ContactForm shape, so skip model validation and encoding
+        return Response(content=dump_json(contacts), media_type="application/json", headers=headers)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/contact/search")
+async def search_contact_forms(
+    q: Optional[str] = Query(None, min_length=1, max_length=200),
+    service: Optional[str] = None,
+    email: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    limit: int = Query(CONTACT_PAGE_SIZE, ge=1, le=CONTACT_PAGE_MAX),
+    cursor: Optional[str] = None
+):
+    filters = {}
+    if q:
+        filters["$text"] = {"$search": q}
+    if service:
+        filters["service"] = service
+    if email:
+        filters["email"] = email
+    if date_from or date_to:
+        filters["created_at"] = {}
+        if date_from:
+            filters["created_at"]["$gte"] = date_from
+        if date_to:
+            filters["created_at"]["$lt"] = date_to
+
+    page_filter = keyset_filter(cursor)
+    query = {"$and": [filters, page_filter]} if page_filter else filters
     try:
-        contacts = await db.contact_forms.find().to_list(1000)
-        return [ContactForm(**contact) for contact in contacts]
+        contacts = await db.contact_forms.find(query, CONTACT_PROJECTION).sort(CONTACT_SORT).limit(limit + 1).to_list(limit + 1)
+        next_cursor = None
+        if len(contacts) > limit:
+            contacts = contacts[:limit]
+            next_cursor = encode_cursor(contacts[-1]["created_at"], contacts[-1]["id"])
+
+        # Collection metadata when unfiltered, otherwise a count that stops at the cap
+        if filters:
+            total = await db.contact_forms.count_documents(filters, limit=CONTACT_SEARCH_COUNT_CAP)
+            total_capped = total >= CONTACT_SEARCH_COUNT_CAP
+        else:
+            total = await db.contact_forms.estimated_document_count()
+            total_capped = False
+
+        return Response(content=dump_json({
+            "items": contacts,
+            "next_cursor": next_cursor,
+            "total": total,
+            "total_capped": total_capped
+        }), media_type="application/json")
     except Exception as e:
+        logging.error(f"Contact search error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/export/{dataset}", dependencies=[Depends(require_admin)])
+async def export_dataset(
+    dataset: str,
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    gzip: bool = False
+):
+    if dataset not in EXPORTS:
+        raise HTTPException(status_code=404, detail="Unknown export")
+    collection, fields, sort = EXPORTS[dataset]
+
+    projection = {"_id": 0, **{field: 1 for field in fields}}
+    cursor = db[collection].find({}, projection).batch_size(export_batch_size)
+    if sort:
+        cursor = cursor.sort(sort)
+
+    if format == "csv":
+        body = stream_csv(cursor, fields)
+        media_type = "text/csv"
+    else:
+        body = stream_ndjson(cursor)
+        media_type = "application/x-ndjson"
+
+    filename = f"{dataset}-{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')}.{format}"
+    if gzip:
+        body = gzip_stream(body)
+        media_type = "application/gzip"
+        filename += ".gz"
+    return StreamingResponse(body, media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="{filename}"'
+    })
+
+@api_router.get("/plans")
+async def get_plans(request: Request):
+    headers = {"ETag": plan_catalog.etag, "Cache-Control": f"public, max-age={plans_max_age}"}
+    if etag_matches(request.headers.get("if-none-match"), plan_catalog.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=plan_catalog.body, media_type="application/json", headers=headers)
+
+@api_router.post("/plans/reload", dependencies=[Depends(require_admin)])
+async def reload_plans():
+    reloaded = await plan_catalog.load()
+    return {"reloaded": reloaded, "etag": plan_catalog.etag}
+
 @api_router.post("/checkout/session")
 async def create_checkout_session(request: Request, checkout_data: CheckoutRequest):
+    await enforce_rate_limit(request, "checkout", checkout_data.customer_email)
+    async with write_shedder.slot():
+        return await start_checkout_session(request, checkout_data)
+
+async def start_checkout_session(request: Request, checkout_data: CheckoutRequest):
     try:
-        # Get host URL from request
-        host_url = str(request.base_url).rstrip('/')
+        # Prefer the configured origin; the Host header is client-controlled
+        host_url = public_base_url or str(request.base_url).rstrip('/')
         
         # Determine amount based on plan type
         if checkout_data.plan_type == "custom":
@@ -106,129 +2134,276 @@ async def create_checkout_session(request: Request, checkout_data: CheckoutReque
                 raise HTTPException(status_code=400, detail="Invalid custom amount")
             amount = float(checkout_data.custom_amount)
             plan_name = f"Custom Plan - ${amount}"
-        elif checkout_data.plan_type in PLANS:
-            amount = PLANS[checkout_data.plan_type]["amount"]
-            plan_name = PLANS[checkout_data.plan_type]["name"]
+        elif checkout_data.plan_type in plan_catalog.plans:
+            plan = plan_catalog.plans[checkout_data.plan_type]
+            amount = plan["amount"]
+            plan_name = plan["name"]
         else:
             raise HTTPException(status_code=400, detail="Invalid plan type")
         
-        # Create success and cancel URLs
-        success_url = f"{host_url}/checkout/success?session_id={{CHECKOUT_SESSION_ID}}"
-        cancel_url = f"{host_url}/checkout/cancel"
-        
-        # Initialize Stripe checkout
-        webhook_url = f"{host_url}/api/webhook/stripe"
-        stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url=webhook_url)
-        
-        # Create checkout session
-        checkout_request = CheckoutSessionRequest(
-            amount=amount,
-            currency="usd",
-            success_url=success_url,
-            cancel_url=cancel_url,
-            metadata={
-                "plan_type": checkout_data.plan_type,
-                "customer_email": checkout_data.customer_email or "",
-                "plan_name": plan_name
-            }
-        )
-        
-        session: CheckoutSessionResponse = await stripe_checkout.create_checkout_session(checkout_request)
-        
-        # Store payment transaction
-        transaction = PaymentTransaction(
-            session_id=session.session_id,
-            amount=amount,
-            currency="usd",
-            plan_type=checkout_data.plan_type,
-            customer_email=checkout_data.customer_email,
-            metadata={
-                "plan_name": plan_name,
-                "checkout_url": session.url
-            }
-        )
+        idempotency_key = request.headers.get("Idempotency-Key")
         
-        await db.payment_transactions.insert_one(transaction.dict())
+        async def open_session():
+            return await open_checkout_session(host_url, checkout_data, amount, plan_name, idempotency_key)
         
-        return {"url": session.url, "session_id": session.session_id}
+        if idempotency_key:
+            return await idempotency_store.run(idempotency_key, checkout_fingerprint(checkout_data), open_session)
+        return await open_session()
         
+    except HTTPException:
+        raise
+    except PaymentUnavailableError as e:
+        logging.error(f"Checkout session creation error: {str(e)}")
+        raise payment_unavailable(e)
     except Exception as e:
         logging.error(f"Checkout session creation error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def open_checkout_session(host_url: str, checkout_data: CheckoutRequest, amount: float,
+                                plan_name: str, idempotency_key: Optional[str] = None) -> Dict:
+    # Create success and cancel URLs
+    success_url = f"{host_url}/checkout/success?session_id={{CHECKOUT_SESSION_ID}}"
+    cancel_url = f"{host_url}/checkout/cancel"
+    
+    webhook_url = f"{host_url}/api/webhook/stripe"
+    
+    # Create checkout session
+    session: CheckoutSessionResponse = await payment_client.create_checkout_session(
+        amount=amount,
+        currency="usd",
+        success_url=success_url,
+        cancel_url=cancel_url,
+        metadata={
+            "plan_type": checkout_data.plan_type,
+            "customer_email": checkout_data.customer_email or "",
+            "plan_name": plan_name
+        },
+        webhook_url=webhook_url,
+        idempotency_key=idempotency_key
+    )
+    
+    # Store payment transaction
+    metadata = {
+        "plan_name": plan_name,
+        "checkout_url": session.url
+    }
+    if idempotency_key:
+        metadata["idempotency_key"] = idempotency_key
+    transaction = PaymentTransaction(
+        session_id=session.session_id,
+        amount=amount,
+        currency="usd",
+        plan_type=checkout_data.plan_type,
+        customer_email=checkout_data.customer_email,
+        metadata=metadata
+    )
+    
+    transaction_doc = transaction.dict()
+    await db.payment_transactions.insert_one(transaction_doc)
+    await apply_rollups(rollup_operations(transaction_doc, None, transaction.payment_status))
+    
+    return {"url": session.url, "session_id": session.session_id}
+
 @api_router.get("/checkout/status/{session_id}")
-async def get_checkout_status(session_id: str):
+async def get_checkout_status(session_id: str, request: Request):
     try:
-        # Initialize Stripe checkout
-        stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url="")
-        
-        # Get status from Stripe
-        status_response: CheckoutStatusResponse = await stripe_checkout.get_checkout_status(session_id)
-        
-        # Update our database
-        transaction = await db.payment_transactions.find_one({"session_id": session_id})
-        if transaction:
-            update_data = {
-                "payment_status": status_response.payment_status,
-                "status": status_response.status,
-                "updated_at": datetime.now(timezone.utc)
-            }
-            
-            await db.payment_transactions.update_one(
-                {"session_id": session_id},
-                {"$set": update_data}
-            )
-        
-        return {
-            "status": status_response.status,
-            "payment_status": status_response.payment_status,
-            "amount_total": status_response.amount_total,
-            "currency": status_response.currency,
-            "metadata": status_response.metadata
-        }
+        payload = await status_cache.get_or_load(session_id, load_checkout_status)
+        if not is_terminal_status(payload["status"], payload["payment_status"]):
+            return payload
+
+        # A settled session never changes, so its tag comes from the status fields alone
+        etag = make_etag(session_id, payload["status"], payload["payment_status"], payload["amount_total"])
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        return ORJSONResponse(payload, headers={"ETag": etag})
         
+    except PaymentUnavailableError as e:
+        logging.error(f"Checkout status error: {str(e)}")
+        raise payment_unavailable(e)
     except Exception as e:
         logging.error(f"Checkout status error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/checkout/status/{session_id}/stream")
+async def stream_checkout_status(session_id: str):
+    async def events():
+        yield b"retry: 3000\n\n"
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + status_stream_timeout
+        waiter = status_broker.subscribe(session_id)
+        try:
+            while True:
+                # Subscribed before reading, so a change landing in between still wakes us
+                try:
+                    payload = await status_cache.get_or_load(session_id, load_checkout_status)
+                except Exception as e:
+                    logging.error(f"Checkout status stream error: {str(e)}")
+                    yield b"event: error\ndata: " + dump_json({"detail": str(e)}) + b"\n\n"
+                    return
+                if is_terminal_status(payload["status"], payload["payment_status"]):
+                    yield b"event: status\ndata: " + dump_json(payload) + b"\n\n"
+                    return
+
+                while not waiter.done():
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        yield b"event: timeout\ndata: {}\n\n"
+                        return
+                    await asyncio.wait([waiter], timeout=min(status_stream_heartbeat, remaining))
+                    if waiter.done():
+                        break
+                    # Another worker may have applied the change; one indexed read per
+                    # heartbeat catches it when no change stream is feeding the broker
+                    if status_broker.source != "change_stream":
+                        transaction = await db.payment_transactions.find_one(
+                            {"session_id": session_id}, {"_id": 0, "status": 1, "payment_status": 1}
+                        )
+                        if transaction and is_terminal_status(transaction.get("status"), transaction.get("payment_status")):
+                            status_cache.invalidate(session_id)
+                            break
+                    yield b": keep-alive\n\n"
+                status_broker.unsubscribe(session_id, waiter)
+                waiter = status_broker.subscribe(session_id)
+        finally:
+            status_broker.unsubscribe(session_id, waiter)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
 @api_router.post("/webhook/stripe")
 async def stripe_webhook(request: Request):
     try:
         body = await request.body()
         signature = request.headers.get("stripe-signature")
         
-        # Initialize Stripe checkout
-        stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url="")
-        
-        # Handle webhook
-        webhook_response = await stripe_checkout.handle_webhook(body, signature)
+        # Verify the signature and parse the event
+        webhook_response = await payment_client.handle_webhook(body, signature)
         
-        # Update transaction in database
-        if webhook_response.session_id:
-            await db.payment_transactions.update_one(
-                {"session_id": webhook_response.session_id},
-                {"$set": {
-                    "payment_status": webhook_response.payment_status,
-                    "updated_at": datetime.now(timezone.utc)
-                }}
-            )
+        # Persist the raw event; workers apply it to the transaction in the background
+        now = datetime.now(timezone.utc)
+        try:
+            await db.webhook_events.insert_one({
+                "_id": webhook_response.event_id,
+                "event_type": webhook_response.event_type,
+                "session_id": webhook_response.session_id,
+                "payment_status": webhook_response.payment_status,
+                "payload": body.decode("utf-8", errors="replace"),
+                "state": "pending",
+                "attempts": 0,
+                "received_at": now,
+                "next_attempt_at": now
+            })
+        except DuplicateKeyError:
+            # Stripe redelivered an event we already have
+            return JSONResponse(content={"status": "success"}, status_code=200)
         
+        webhook_processor.notify()
         return JSONResponse(content={"status": "success"}, status_code=200)
         
     except Exception as e:
         logging.error(f"Webhook error: {str(e)}")
         return JSONResponse(content={"error": str(e)}, status_code=400)
 
-# Include the router in the main app
-app.include_router(api_router)
+@api_router.get("/admin/stats", dependencies=[Depends(require_admin)])
+async def get_admin_stats(days: int = Query(30, ge=1, le=3650)):
+    try:
+        since = (datetime.now(timezone.utc) - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+        buckets = await db.payment_rollups.find({"day": {"$gte": since}, "count": {"$gt": 0}}, {"_id": 0}).to_list(None)
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+        def summary():
+            return {"transactions": 0, "paid": 0, "revenue": 0.0}
+
+        totals = summary()
+        by_plan: Dict[str, Dict] = {}
+        by_day: Dict[str, Dict] = {}
+        by_payment_status: Dict[str, Dict] = {}
+        for bucket in buckets:
+            count, amount = bucket["count"], bucket["amount"]
+            paid = bucket["payment_status"] == "paid"
+            for group in (totals, by_plan.setdefault(bucket["plan_type"], summary()), by_day.setdefault(bucket["day"], summary())):
+                group["transactions"] += count
+                if paid:
+                    group["paid"] += count
+                    group["revenue"] += amount
+            status_group = by_payment_status.setdefault(bucket["payment_status"], {"transactions": 0, "amount": 0.0})
+            status_group["transactions"] += count
+            status_group["amount"] += amount
+
+        for group in [totals, *by_plan.values(), *by_day.values()]:
+            group["conversion_rate"] = round(group["paid"] / group["transactions"], 4) if group["transactions"] else 0.0
+
+        return {
+            "since": since,
+            "totals": totals,
+            "by_plan": by_plan,
+            "by_payment_status": by_payment_status,
+            "by_day": [{"day": day, **by_day[day]} for day in sorted(by_day)],
+            "contacts": await db.contact_forms.estimated_document_count()
+        }
+    except Exception as e:
+        logging.error(f"Admin stats error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/admin/reconcile", dependencies=[Depends(require_admin)])
+async def run_reconciliation():
+    try:
+        stats = await reconciliation_sweeper.run_once()
+    except Exception as e:
+        logging.error(f"Reconciliation sweep error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    if stats is None:
+        raise HTTPException(status_code=409, detail="Another reconciliation sweep holds the lease")
+    return stats
+
+@api_router.get("/debug/query-plans")
+async def get_query_plans():
+    try:
+        report = {}
+        for name, (collection, query, sort) in HOT_QUERIES.items():
+            cursor = db[collection].find(query).limit(1)
+            if sort:
+                cursor = cursor.sort(sort)
+            explain = await cursor.explain()
+            stages = plan_stages(explain["queryPlanner"]["winningPlan"])
+            report[name] = {
+                "collection": collection,
+                "stages": stages,
+                "collscan": any(stage["stage"] == "COLLSCAN" for stage in stages)
+            }
+        return report
+    except Exception as e:
+        logging.error(f"Query plan report error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/debug/payment-breaker")
+async def get_payment_breaker_stats():
+    return payment_breaker.stats()
+
+@api_router.get("/debug/webhook-queue")
+async def get_webhook_queue_stats():
+    try:
+        return await webhook_processor.stats()
+    except Exception as e:
+        logging.error(f"Webhook queue stats error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/debug/startup")
+async def get_startup_timings(request: Request):
+    return {"phases_ms": getattr(request.app.state, "startup_timings", {})}
+
+@api_router.get("/metrics")
+async def get_metrics():
+    webhook_lag.set(webhook_processor.last_lag_seconds)
+    webhook_applied.set(webhook_processor.applied_total)
+    status_cache_entries.set(len(status_cache))
+    status_stream_subscribers.set(len(status_broker))
+    writes_shed.set(write_shedder.shed_total)
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
 
 # Configure logging
 logging.basicConfig(
@@ -237,6 +2412,223 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
+async def connect_db_client():
+    global client, db
+    if db is None:
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        client = AsyncIOMotorClient(
+            mongo_url,
+            maxPoolSize=mongo_max_pool_size,
+            minPoolSize=mongo_min_pool_size,
+            serverSelectionTimeoutMS=mongo_server_selection_timeout_ms,
+            connectTimeoutMS=mongo_connect_timeout_ms,
+            socketTimeoutMS=mongo_socket_timeout_ms
+        )
+        db = InstrumentedDatabase(client[mongo_db_name])
+
+async def warm_db_connections():
+    # Open pool connections before the first request needs them
+    try:
+        await asyncio.gather(*[db.command("ping") for _ in range(max(mongo_min_pool_size, 1))])
+    except Exception as e:
+        logging.error(f"MongoDB warm-up error: {str(e)}")
+
+async def create_payment_client():
+    global payment_client
+    if payment_client is None:
+        payment_client = PaymentClient(
+            stripe_api_key, pool_size=stripe_pool_size, timeout=stripe_timeout,
+            call_timeout=payment_call_timeout, breaker=payment_breaker
+        )
+
+async def warm_payment_client():
+    # Import the payment SDK and open its connection pool off the event loop
+    if not isinstance(payment_client, PaymentClient):
+        return
+    try:
+        await payment_client.preload()
+    except Exception as e:
+        logging.error(f"Payment client warm-up error: {str(e)}")
+
+async def load_plan_catalog():
+    await plan_catalog.load()
+    plan_catalog.start(plans_reload_interval)
+
+async def stop_plan_catalog():
+    await plan_catalog.stop()
+
+async def start_webhook_processor():
+    webhook_processor.start()
+
+async def stop_webhook_processor():
+    await webhook_processor.stop()
+
+async def start_reconciliation_sweeper():
+    reconciliation_sweeper.start()
+
+async def stop_reconciliation_sweeper():
+    await reconciliation_sweeper.stop()
+
+async def start_transaction_archiver():
+    transaction_archiver.start()
+
+async def stop_transaction_archiver():
+    await transaction_archiver.stop()
+
+async def start_status_broker():
+    status_broker.start()
+
+async def stop_status_broker():
+    await status_broker.stop()
+
+async def drain_contact_buffer():
+    await contact_buffer.drain()
+
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    global client, db
+    if client is not None:
+        client.close()
+        client = None
+        db = None
+
+async def shutdown_payment_client():
+    if payment_client is not None:
+        payment_client.close()
+
+# Application lifecycle
+@asynccontextmanager
+async def startup_phase(timings: Dict[str, float], name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = round((time.perf_counter() - start) * 1000, 3)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    timings: Dict[str, float] = {}
+    started = time.perf_counter()
+    async with startup_phase(timings, "connect_db"):
+        await connect_db_client()
+
+    # Connection warm-up and index builds do not need to hold up serving
+    background = [
+        asyncio.create_task(warm_db_connections()),
+        asyncio.create_task(ensure_indexes())
+    ]
+
+    async with startup_phase(timings, "payment_client"):
+        await create_payment_client()
+    background.append(asyncio.create_task(warm_payment_client()))
+    async with startup_phase(timings, "plan_catalog"):
+        await load_plan_catalog()
+    async with startup_phase(timings, "webhook_processor"):
+        await start_webhook_processor()
+    async with startup_phase(timings, "reconciliation_sweeper"):
+        await start_reconciliation_sweeper()
+    async with startup_phase(timings, "transaction_archiver"):
+        await start_transaction_archiver()
+    async with startup_phase(timings, "status_broker"):
+        await start_status_broker()
+    timings["total"] = round((time.perf_counter() - started) * 1000, 3)
+    app.state.startup_timings = timings
+    logging.info(f"Startup phases (ms): {timings}")
+
+    try:
+        yield
+    finally:
+        await stop_plan_catalog()
+        await stop_reconciliation_sweeper()
+        await stop_transaction_archiver()
+        await stop_status_broker()
+        await stop_webhook_processor()
+        await drain_contact_buffer()
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        await shutdown_db_client()
+        await shutdown_payment_client()
+
+def create_app() -> FastAPI:
+    # Create the main app without a prefix
+    app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
+
+    # Include the router in the main app
+    app.include_router(api_router)
+
+    # Tags are computed on the identity body, before compression
+    app.add_middleware(ETagMiddleware)
+    app.add_middleware(CompressionMiddleware, minimum_size=compression_min_size)
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["X-Next-Cursor", "ETag"],
+    )
+
+    app.add_middleware(MetricsMiddleware)
+    return app
+
+app = create_app()
+
+async def rebuild_stats():
+    await connect_db_client()
+    try:
+        await rebuild_payment_rollups()
+        logging.info("Payment rollups rebuilt")
+    finally:
+        await shutdown_db_client()
+
+async def archive_transactions():
+    await connect_db_client()
+    try:
+        result = await transaction_archiver.archive()
+        logging.info(f"Transaction archival finished: {result}")
+    finally:
+        await shutdown_db_client()
+
+def main():
+    import argparse
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run the Web X Media API")
+    parser.add_argument("command", nargs="?", default="serve", choices=["serve", "rebuild-stats", "archive"])
+    parser.add_argument("--host", default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument("--port", type=int, default=int(os.environ.get('PORT', '8001')))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1)))
+    parser.add_argument("--graceful-timeout", type=int, default=int(os.environ.get('GRACEFUL_TIMEOUT', '30')))
+    args = parser.parse_args()
+
+    if args.command == "rebuild-stats":
+        asyncio.run(rebuild_stats())
+        return
+    if args.command == "archive":
+        asyncio.run(archive_transactions())
+        return
+
+    if args.workers > 1 and status_events_source != "change_stream":
+        logging.warning(
+            f"Running {args.workers} workers with STATUS_EVENTS_SOURCE={status_events_source}: status streams "
+            f"see other workers' changes only on their heartbeat re-check; set change_stream to push them"
+        )
+
+    # Each worker process imports the app and opens its own Motor client on startup.
+    # On SIGTERM uvicorn stops accepting connections, waits for in-flight requests
+    # up to the graceful timeout, then runs the shutdown hooks that drain buffers.
+    uvicorn.run(
+        "server:app",
+        app_dir=str(ROOT_DIR),
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop="uvloop",
+        http="httptools",
+        timeout_graceful_shutdown=args.graceful_timeout
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+
+BACKEND_DIR = Path(__file__).parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "webx_benchmark")
+
+import server  # noqa: E402
+
+# Per-request client logging would dominate the measurements
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+CONTACT_FORM = {
+    "name": "Benchmark User",
+    "email": "bench@example.com",
+    "phone": "+91 98765 43210",
+    "service": "Web Design & Development",
+    "message": "Benchmark contact form submission."
+}
+
+PLANS = ["bronze", "silver", "gold", "custom"]
+
+
+class StubPaymentClient:
+    """In-process stand-in for server.PaymentClient with simulated provider latency"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+
+    async def _delay(self):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def create_checkout_session(self, amount: float, currency: str, success_url: str,
+                                      cancel_url: str, metadata: Dict, webhook_url: str = "",
+                                      idempotency_key: Optional[str] = None):
+        await self._delay()
+        session_id = f"cs_bench_{uuid.uuid4().hex}"
+        return SimpleNamespace(url=f"https://checkout.stripe.com/pay/{session_id}", session_id=session_id)
+
+    async def get_checkout_status(self, session_id: str):
+        await self._delay()
+        return SimpleNamespace(status="open", payment_status="unpaid", amount_total=5000,
+                               currency="usd", metadata={})
+
+    async def handle_webhook(self, body: bytes, signature: Optional[str]):
+        await self._delay()
+        event = json.loads(body)
+        return SimpleNamespace(event_type=event.get("type", "checkout.session.completed"),
+                               event_id=event["id"], session_id=event["session_id"],
+                               payment_status=event.get("payment_status", "paid"), metadata={})
+
+    def close(self):
+        pass
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class WebXMediaAPIBenchmark:
+    def __init__(self, requests_per_scenario: int = 200, concurrency: int = 20,
+                 mongo_url: Optional[str] = None, stripe_latency: float = 0.0):
+        self.requests_per_scenario = requests_per_scenario
+        self.concurrency = concurrency
+        self.mongo_url = mongo_url
+        self.stripe_latency = stripe_latency
+        self.session_ids: List[str] = []
+        self.results: Dict[str, Dict[str, Any]] = {}
+
+    async def setup(self):
+        """Point the app at a local database and a stubbed Stripe client, then run startup"""
+        if self.mongo_url:
+            from motor.motor_asyncio import AsyncIOMotorClient
+            database = AsyncIOMotorClient(self.mongo_url)[f"webx_benchmark_{uuid.uuid4().hex[:8]}"]
+        else:
+            from mongomock_motor import AsyncMongoMockClient
+            database = AsyncMongoMockClient()["webx_benchmark"]
+        server.db = server.InstrumentedDatabase(database)
+        server.payment_client = StubPaymentClient(self.stripe_latency)
+        # Every benchmark request comes from one client, so per-client limits would reject most of them
+        server.rate_limit_enabled = False
+        self.lifespan = server.app.router.lifespan_context(server.app)
+        await self.lifespan.__aenter__()
+
+    async def teardown(self):
+        """Run app shutdown and drop the benchmark database"""
+        await self.lifespan.__aexit__(None, None, None)
+        if self.mongo_url:
+            await server.db.client.drop_database(server.db.name)
+
+    async def run_scenario(self, client: httpx.AsyncClient, name: str, make_request: Callable):
+        """Issue requests_per_scenario requests at the configured concurrency and record latencies"""
+        latencies: List[float] = []
+        errors = 0
+        remaining = iter(range(self.requests_per_scenario))
+
+        async def worker():
+            nonlocal errors
+            for index in remaining:
+                start = time.perf_counter()
+                try:
+                    response = await make_request(client, index)
+                    ok = response.status_code < 400
+                except Exception:
+                    ok = False
+                latencies.append((time.perf_counter() - start) * 1000)
+                if not ok:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(self.concurrency)])
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        self.results[name] = {
+            "requests": len(latencies),
+            "errors": errors,
+            "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+            "mean_ms": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+            "p50_ms": round(percentile(latencies, 50), 3),
+            "p95_ms": round(percentile(latencies, 95), 3),
+            "p99_ms": round(percentile(latencies, 99), 3),
+            "max_ms": round(latencies[-1], 3) if latencies else 0.0
+        }
+        print(f"⏱  {name}: {self.results[name]['throughput_rps']} req/s, "
+              f"p50 {self.results[name]['p50_ms']} ms, p95 {self.results[name]['p95_ms']} ms, "
+              f"p99 {self.results[name]['p99_ms']} ms, errors {errors}")
+
+    async def create_session(self, client: httpx.AsyncClient, plan: str):
+        """Create one checkout session and remember its id for the polling scenarios"""
+        payload = {"plan_type": plan, "customer_email": "bench@example.com"}
+        if plan == "custom":
+            payload["custom_amount"] = 500.0
+        response = await client.post("/api/checkout/session", json=payload)
+        if response.status_code == 200:
+            self.session_ids.append(response.json()["session_id"])
+        return response
+
+    def webhook_request(self, client: httpx.AsyncClient, index: int):
+        """Deliver a completed-payment event for one of the created sessions"""
+        body = json.dumps({
+            "id": f"evt_bench_{uuid.uuid4().hex}",
+            "type": "checkout.session.completed",
+            "session_id": self.session_ids[index % len(self.session_ids)],
+            "payment_status": "paid"
+        })
+        return client.post("/api/webhook/stripe", content=body, headers={"stripe-signature": "bench"})
+
+    async def run_all(self) -> Dict[str, Any]:
+        """Run every scenario against the in-process app"""
+        print("🚀 Starting Web X Media API Benchmark")
+        print(f"   {self.requests_per_scenario} requests per scenario, concurrency {self.concurrency}")
+        print("=" * 50)
+
+        await self.setup()
+        try:
+            transport = httpx.ASGITransport(app=server.app)
+            limits = httpx.Limits(max_connections=self.concurrency)
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", limits=limits) as client:
+                await self.run_scenario(client, "GET /api/", lambda c, i: c.get("/api/"))
+                await self.run_scenario(client, "POST /api/contact",
+                                        lambda c, i: c.post("/api/contact", json=CONTACT_FORM))
+                await self.run_scenario(client, "GET /api/contact", lambda c, i: c.get("/api/contact"))
+                for plan in PLANS:
+                    await self.run_scenario(client, f"POST /api/checkout/session ({plan})",
+                                            lambda c, i, plan=plan: self.create_session(c, plan))
+                if self.session_ids:
+                    await self.run_scenario(client, "GET /api/checkout/status/{session_id}",
+                                            lambda c, i: c.get(f"/api/checkout/status/{random.choice(self.session_ids)}"))
+                    await self.run_scenario(client, "POST /api/webhook/stripe", self.webhook_request)
+        finally:
+            await self.teardown()
+
+        return {
+            "config": {
+                "requests_per_scenario": self.requests_per_scenario,
+                "concurrency": self.concurrency,
+                "database": "mongod" if self.mongo_url else "mongomock",
+                "stripe_latency_ms": self.stripe_latency * 1000
+            },
+            "endpoints": self.results,
+            "timestamp": datetime.now().isoformat()
+        }
+
+
+def benchmark_serialization(records: int = 1000, rounds: int = 50) -> Dict[str, Any]:
+    """CPU time per 1000 contact documents: Pydantic + jsonable_encoder versus raw orjson"""
+    from fastapi.encoders import jsonable_encoder
+
+    created_at = datetime.utcnow()
+    docs = [{"id": str(uuid.uuid4()), **CONTACT_FORM, "created_at": created_at} for _ in range(records)]
+
+    def model_path():
+        # What GET /api/contact used to do: build models, encode, then json.dumps
+        models = [server.ContactForm(**doc) for doc in docs]
+        return json.dumps(jsonable_encoder(models), separators=(",", ":")).encode()
+
+    def raw_path():
+        return server.dump_json(docs)
+
+    results = {"records": records, "rounds": rounds}
+    for name, serialize in (("pydantic_jsonable_encoder", model_path), ("orjson_raw", raw_path)):
+        serialize()
+        start = time.process_time()
+        for _ in range(rounds):
+            serialize()
+        per_round = (time.process_time() - start) / rounds
+        results[f"{name}_cpu_ms_per_1000"] = round(per_round * 1000 * 1000 / records, 3)
+        print(f"⏱  {name}: {results[f'{name}_cpu_ms_per_1000']} ms CPU per 1000 records")
+    return results
+
+
+STARTUP_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import server
+print(json.dumps({
+    "import_ms": (time.perf_counter() - started) * 1000,
+    "payment_sdk_loaded": "stripe" in sys.modules or "emergentintegrations" in sys.modules
+}))
+"""
+
+
+def benchmark_startup(runs: int = 5) -> Dict[str, Any]:
+    """Cold import time in fresh interpreters plus the app's own startup phase timings"""
+    imports = []
+    for _ in range(runs):
+        completed = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], cwd=BACKEND_DIR,
+                                   capture_output=True, text=True, check=True)
+        imports.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    import_ms = sorted(run["import_ms"] for run in imports)
+
+    async def lifespan_phases():
+        from mongomock_motor import AsyncMongoMockClient
+        server.db = server.InstrumentedDatabase(AsyncMongoMockClient()["webx_benchmark"])
+        async with server.app.router.lifespan_context(server.app):
+            return dict(server.app.state.startup_timings)
+
+    results = {
+        "runs": runs,
+        "import_ms_min": round(import_ms[0], 3),
+        "import_ms_median": round(import_ms[len(import_ms) // 2], 3),
+        "payment_sdk_loaded_at_import": any(run["payment_sdk_loaded"] for run in imports),
+        "startup_phases_ms": asyncio.run(lifespan_phases())
+    }
+    print(f"⏱  import: min {results['import_ms_min']} ms, median {results['import_ms_median']} ms")
+    print(f"⏱  startup phases: {results['startup_phases_ms']}")
+    return results
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """List endpoints whose p95 latency regressed by more than threshold against the baseline"""
+    regressions = []
+    for name, stats in report["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(name)
+        if not previous or not previous.get("p95_ms"):
+            continue
+        change = (stats["p95_ms"] - previous["p95_ms"]) / previous["p95_ms"]
+        if change > threshold:
+            regressions.append(f"{name}: p95 {previous['p95_ms']} ms -> {stats['p95_ms']} ms (+{change * 100:.1f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Web X Media API in-process")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--mongo-url", help="use a local mongod instead of mongomock")
+    parser.add_argument("--stripe-latency-ms", type=float, default=0.0, help="simulated payment provider latency")
+    parser.add_argument("--output", default="backend_benchmark_results.json")
+    parser.add_argument("--baseline", help="previous results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed p95 regression, as a fraction")
+    parser.add_argument("--serialization", action="store_true",
+                        help="only run the contact list serialization micro-benchmark")
+    parser.add_argument("--startup", action="store_true",
+                        help="only measure cold import and startup phase timings")
+    args = parser.parse_args()
+
+    if args.serialization or args.startup:
+        report = {"timestamp": datetime.now().isoformat()}
+        if args.serialization:
+            report["serialization"] = benchmark_serialization()
+        if args.startup:
+            report["startup"] = benchmark_startup()
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        return 0
+
+    benchmark = WebXMediaAPIBenchmark(
+        requests_per_scenario=args.requests,
+        concurrency=args.concurrency,
+        mongo_url=args.mongo_url,
+        stripe_latency=args.stripe_latency_ms / 1000
+    )
+    report = asyncio.run(benchmark.run_all())
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("=" * 50)
+    print(f"📊 Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"❌ REGRESSION - {regression}")
+        if regressions:
+            return 1
+        print("✅ No p95 regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
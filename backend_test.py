@@ -1,309 +1,172 @@
 #!/usr/bin/env python3
 
-import requests
-import sys
+import argparse
+import asyncio
 import json
+import sys
+import time
 from datetime import datetime
-from typing import Dict, Any
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+import httpx
+
+DEFAULT_OUTPUT = Path(__file__).parent / "backend_test_results.json"
+
+CONTACT_FORM = {
+    "name": "Test User",
+    "email": "test@example.com",
+    "phone": "+91 98765 43210",
+    "service": "Web Design & Development",
+    "message": "This is a test message for the contact form."
+}
+
+# A check returns (success, details, response_data, value handed to dependent checks)
+CheckResult = Tuple[bool, str, Any, Any]
+
 
 class WebXMediaAPITester:
-    def __init__(self, base_url="https://sitespark.preview.emergentagent.com"):
-        self.base_url = base_url
+    def __init__(self, client: httpx.AsyncClient):
+        self.client = client
         self.tests_run = 0
         self.tests_passed = 0
         self.test_results = []
 
-    def log_test(self, name: str, success: bool, details: str = "", response_data: Any = None):
+    def log_test(self, name: str, success: bool, details: str = "", response_data: Any = None,
+                 duration_ms: float = 0.0):
         """Log test result"""
         self.tests_run += 1
         if success:
             self.tests_passed += 1
-            
+
         result = {
             "test_name": name,
             "success": success,
             "details": details,
             "response_data": response_data,
+            "duration_ms": round(duration_ms, 2),
             "timestamp": datetime.now().isoformat()
         }
         self.test_results.append(result)
-        
+
         status = "✅ PASSED" if success else "❌ FAILED"
-        print(f"{status} - {name}")
+        print(f"{status} - {name} ({duration_ms:.1f} ms)")
         if details:
             print(f"   Details: {details}")
         if not success and response_data:
             print(f"   Response: {response_data}")
         print()
 
-    def test_api_root(self):
-        """Test API root endpoint"""
+    async def run_check(self, name: str, check: Callable[[], Awaitable[CheckResult]]) -> Any:
+        """Time a single check, log its outcome and return its value for dependent checks"""
+        start = time.perf_counter()
         try:
-            response = requests.get(f"{self.base_url}/api/", timeout=10)
-            success = response.status_code == 200
-            
-            if success:
-                data = response.json()
-                self.log_test("API Root", True, f"Status: {response.status_code}, Message: {data.get('message', 'N/A')}")
-            else:
-                self.log_test("API Root", False, f"Status: {response.status_code}", response.text)
-                
+            success, details, response_data, value = await check()
         except Exception as e:
-            self.log_test("API Root", False, f"Exception: {str(e)}")
+            success, details, response_data, value = False, f"Exception: {str(e)}", None, None
+        self.log_test(name, success, details, response_data, (time.perf_counter() - start) * 1000)
+        return value
+
+    async def test_api_root(self):
+        """Test API root endpoint"""
+        async def check() -> CheckResult:
+            response = await self.client.get("/api/")
+            if response.status_code != 200:
+                return False, f"Status: {response.status_code}", response.text, None
+            data = response.json()
+            return True, f"Status: {response.status_code}, Message: {data.get('message', 'N/A')}", None, None
+
+        await self.run_check("API Root", check)
 
-    def test_contact_form_submission(self):
+    async def test_contact_form_submission(self):
         """Test contact form submission"""
-        test_data = {
-            "name": "Test User",
-            "email": "test@example.com",
-            "phone": "+91 98765 43210",
-            "service": "Web Design & Development",
-            "message": "This is a test message for the contact form."
-        }
-        
-        try:
-            response = requests.post(
-                f"{self.base_url}/api/contact",
-                json=test_data,
-                headers={'Content-Type': 'application/json'},
-                timeout=10
-            )
-            
-            success = response.status_code == 200
-            
-            if success:
-                data = response.json()
-                self.log_test("Contact Form Submission", True, 
-                            f"Status: {response.status_code}, Success: {data.get('success', False)}")
-            else:
-                self.log_test("Contact Form Submission", False, 
-                            f"Status: {response.status_code}", response.text)
-                
-        except Exception as e:
-            self.log_test("Contact Form Submission", False, f"Exception: {str(e)}")
+        async def check() -> CheckResult:
+            response = await self.client.post("/api/contact", json=CONTACT_FORM)
+            if response.status_code != 200:
+                return False, f"Status: {response.status_code}", response.text, None
+            data = response.json()
+            return True, f"Status: {response.status_code}, Success: {data.get('success', False)}", None, None
+
+        await self.run_check("Contact Form Submission", check)
 
-    def test_contact_form_retrieval(self):
+    async def test_contact_form_retrieval(self):
         """Test contact form retrieval"""
-        try:
-            response = requests.get(f"{self.base_url}/api/contact", timeout=10)
-            success = response.status_code == 200
-            
-            if success:
-                data = response.json()
-                self.log_test("Contact Form Retrieval", True, 
-                            f"Status: {response.status_code}, Forms count: {len(data) if isinstance(data, list) else 'N/A'}")
-            else:
-                self.log_test("Contact Form Retrieval", False, 
-                            f"Status: {response.status_code}", response.text)
-                
-        except Exception as e:
-            self.log_test("Contact Form Retrieval", False, f"Exception: {str(e)}")
+        async def check() -> CheckResult:
+            response = await self.client.get("/api/contact")
+            if response.status_code != 200:
+                return False, f"Status: {response.status_code}", response.text, None
+            data = response.json()
+            count = len(data) if isinstance(data, list) else 'N/A'
+            return True, f"Status: {response.status_code}, Forms count: {count}", None, None
 
-    def test_checkout_session_bronze(self):
-        """Test checkout session creation for Bronze plan"""
-        test_data = {
-            "plan_type": "bronze",
-            "customer_email": "test@example.com"
-        }
-        
-        try:
-            response = requests.post(
-                f"{self.base_url}/api/checkout/session",
-                json=test_data,
-                headers={'Content-Type': 'application/json'},
-                timeout=15
-            )
-            
-            success = response.status_code == 200
-            
-            if success:
-                data = response.json()
-                has_url = 'url' in data and data['url']
-                has_session_id = 'session_id' in data and data['session_id']
-                
-                if has_url and has_session_id:
-                    self.log_test("Checkout Session (Bronze)", True, 
-                                f"Status: {response.status_code}, URL: {data['url'][:50]}..., Session ID: {data['session_id'][:20]}...")
-                    return data['session_id']
-                else:
-                    self.log_test("Checkout Session (Bronze)", False, 
-                                "Missing URL or session_id in response", data)
-            else:
-                self.log_test("Checkout Session (Bronze)", False, 
-                            f"Status: {response.status_code}", response.text)
-                
-        except Exception as e:
-            self.log_test("Checkout Session (Bronze)", False, f"Exception: {str(e)}")
-        
-        return None
-
-    def test_checkout_session_silver(self):
-        """Test checkout session creation for Silver plan"""
-        test_data = {
-            "plan_type": "silver",
-            "customer_email": "test@example.com"
-        }
-        
-        try:
-            response = requests.post(
-                f"{self.base_url}/api/checkout/session",
-                json=test_data,
-                headers={'Content-Type': 'application/json'},
-                timeout=15
-            )
-            
-            success = response.status_code == 200
-            
-            if success:
-                data = response.json()
-                has_url = 'url' in data and data['url']
-                has_session_id = 'session_id' in data and data['session_id']
-                
-                if has_url and has_session_id:
-                    self.log_test("Checkout Session (Silver)", True, 
-                                f"Status: {response.status_code}, URL: {data['url'][:50]}..., Session ID: {data['session_id'][:20]}...")
-                else:
-                    self.log_test("Checkout Session (Silver)", False, 
-                                "Missing URL or session_id in response", data)
-            else:
-                self.log_test("Checkout Session (Silver)", False, 
-                            f"Status: {response.status_code}", response.text)
-                
-        except Exception as e:
-            self.log_test("Checkout Session (Silver)", False, f"Exception: {str(e)}")
+        await self.run_check("Contact Form Retrieval", check)
 
-    def test_checkout_session_gold(self):
-        """Test checkout session creation for Gold plan"""
-        test_data = {
-            "plan_type": "gold",
-            "customer_email": "test@example.com"
-        }
-        
-        try:
-            response = requests.post(
-                f"{self.base_url}/api/checkout/session",
-                json=test_data,
-                headers={'Content-Type': 'application/json'},
-                timeout=15
-            )
-            
-            success = response.status_code == 200
-            
-            if success:
-                data = response.json()
-                has_url = 'url' in data and data['url']
-                has_session_id = 'session_id' in data and data['session_id']
-                
-                if has_url and has_session_id:
-                    self.log_test("Checkout Session (Gold)", True, 
-                                f"Status: {response.status_code}, URL: {data['url'][:50]}..., Session ID: {data['session_id'][:20]}...")
-                else:
-                    self.log_test("Checkout Session (Gold)", False, 
-                                "Missing URL or session_id in response", data)
-            else:
-                self.log_test("Checkout Session (Gold)", False, 
-                            f"Status: {response.status_code}", response.text)
-                
-        except Exception as e:
-            self.log_test("Checkout Session (Gold)", False, f"Exception: {str(e)}")
-
-    def test_checkout_session_custom(self):
-        """Test checkout session creation for Custom plan"""
-        test_data = {
-            "plan_type": "custom",
-            "customer_email": "test@example.com",
-            "custom_amount": 500.0
-        }
-        
-        try:
-            response = requests.post(
-                f"{self.base_url}/api/checkout/session",
-                json=test_data,
-                headers={'Content-Type': 'application/json'},
-                timeout=15
-            )
-            
-            success = response.status_code == 200
-            
-            if success:
-                data = response.json()
-                has_url = 'url' in data and data['url']
-                has_session_id = 'session_id' in data and data['session_id']
-                
-                if has_url and has_session_id:
-                    self.log_test("Checkout Session (Custom)", True, 
-                                f"Status: {response.status_code}, URL: {data['url'][:50]}..., Session ID: {data['session_id'][:20]}...")
-                    return data['session_id']
-                else:
-                    self.log_test("Checkout Session (Custom)", False, 
-                                "Missing URL or session_id in response", data)
-            else:
-                self.log_test("Checkout Session (Custom)", False, 
-                            f"Status: {response.status_code}", response.text)
-                
-        except Exception as e:
-            self.log_test("Checkout Session (Custom)", False, f"Exception: {str(e)}")
-        
-        return None
+    async def test_checkout_session(self, plan_type: str, custom_amount: Optional[float] = None) -> Optional[str]:
+        """Test checkout session creation for a plan, returning the session ID"""
+        test_data = {"plan_type": plan_type, "customer_email": "test@example.com"}
+        if custom_amount is not None:
+            test_data["custom_amount"] = custom_amount
+
+        async def check() -> CheckResult:
+            response = await self.client.post("/api/checkout/session", json=test_data)
+            if response.status_code != 200:
+                return False, f"Status: {response.status_code}", response.text, None
+            data = response.json()
+            if not data.get("url") or not data.get("session_id"):
+                return False, "Missing URL or session_id in response", data, None
+            details = f"Status: {response.status_code}, URL: {data['url'][:50]}..., Session ID: {data['session_id'][:20]}..."
+            return True, details, None, data["session_id"]
+
+        return await self.run_check(f"Checkout Session ({plan_type.title()})", check)
 
-    def test_checkout_status(self, session_id: str):
+    async def test_checkout_status(self, name: str, session_id: Optional[str]):
         """Test checkout status retrieval"""
-        if not session_id:
-            self.log_test("Checkout Status", False, "No session ID provided")
-            return
-            
-        try:
-            response = requests.get(f"{self.base_url}/api/checkout/status/{session_id}", timeout=10)
-            success = response.status_code == 200
-            
-            if success:
-                data = response.json()
-                self.log_test("Checkout Status", True, 
-                            f"Status: {response.status_code}, Payment Status: {data.get('payment_status', 'N/A')}")
-            else:
-                self.log_test("Checkout Status", False, 
-                            f"Status: {response.status_code}", response.text)
-                
-        except Exception as e:
-            self.log_test("Checkout Status", False, f"Exception: {str(e)}")
+        async def check() -> CheckResult:
+            if not session_id:
+                return False, "No session ID provided", None, None
+            response = await self.client.get(f"/api/checkout/status/{session_id}")
+            if response.status_code != 200:
+                return False, f"Status: {response.status_code}", response.text, None
+            data = response.json()
+            return True, f"Status: {response.status_code}, Payment Status: {data.get('payment_status', 'N/A')}", None, None
+
+        await self.run_check(name, check)
 
-    def test_invalid_endpoints(self):
+    async def test_invalid_endpoints(self):
         """Test invalid endpoints return proper errors"""
-        try:
-            response = requests.get(f"{self.base_url}/api/nonexistent", timeout=10)
-            success = response.status_code == 404
-            
-            self.log_test("Invalid Endpoint (404)", success, 
-                        f"Status: {response.status_code} (Expected 404)")
-                
-        except Exception as e:
-            self.log_test("Invalid Endpoint (404)", False, f"Exception: {str(e)}")
+        async def check() -> CheckResult:
+            response = await self.client.get("/api/nonexistent")
+            return response.status_code == 404, f"Status: {response.status_code} (Expected 404)", None, None
+
+        await self.run_check("Invalid Endpoint (404)", check)
 
-    def run_all_tests(self):
-        """Run all API tests"""
+    async def run_all_tests(self):
+        """Run all API tests, concurrently wherever one check does not depend on another"""
         print("🚀 Starting Web X Media API Tests")
         print("=" * 50)
-        
-        # Basic API tests
-        self.test_api_root()
-        
-        # Contact form tests
-        self.test_contact_form_submission()
-        self.test_contact_form_retrieval()
-        
-        # Checkout session tests
-        bronze_session_id = self.test_checkout_session_bronze()
-        self.test_checkout_session_silver()
-        self.test_checkout_session_gold()
-        custom_session_id = self.test_checkout_session_custom()
-        
-        # Checkout status tests
-        if bronze_session_id:
-            self.test_checkout_status(bronze_session_id)
-        
-        # Error handling tests
-        self.test_invalid_endpoints()
-        
+        started = time.perf_counter()
+
+        async def contact_flow():
+            # Retrieval should see the submission
+            await self.test_contact_form_submission()
+            await self.test_contact_form_retrieval()
+
+        async def checkout_flow(plan_type: str, custom_amount: Optional[float] = None, check_status: bool = False):
+            session_id = await self.test_checkout_session(plan_type, custom_amount)
+            if check_status:
+                await self.test_checkout_status(f"Checkout Status ({plan_type.title()})", session_id)
+
+        await asyncio.gather(
+            self.test_api_root(),
+            contact_flow(),
+            checkout_flow("bronze", check_status=True),
+            checkout_flow("silver"),
+            checkout_flow("gold"),
+            checkout_flow("custom", custom_amount=500.0, check_status=True),
+            self.test_invalid_endpoints()
+        )
+        self.elapsed_ms = (time.perf_counter() - started) * 1000
+
         # Print summary
         print("=" * 50)
         print(f"📊 Test Summary:")
@@ -311,27 +174,61 @@ class WebXMediaAPITester:
         print(f"   Passed: {self.tests_passed}")
         print(f"   Failed: {self.tests_run - self.tests_passed}")
         print(f"   Success Rate: {(self.tests_passed/self.tests_run)*100:.1f}%")
-        
+        print(f"   Wall Time: {self.elapsed_ms:.1f} ms")
+
         return self.tests_passed == self.tests_run
 
+    def write_results(self, path: Path):
+        """Save detailed results"""
+        with open(path, 'w') as f:
+            json.dump({
+                'summary': {
+                    'total_tests': self.tests_run,
+                    'passed_tests': self.tests_passed,
+                    'failed_tests': self.tests_run - self.tests_passed,
+                    'success_rate': (self.tests_passed/self.tests_run)*100 if self.tests_run > 0 else 0,
+                    'duration_ms': round(self.elapsed_ms, 2),
+                    'timestamp': datetime.now().isoformat()
+                },
+                'detailed_results': self.test_results
+            }, f, indent=2)
+
+
+async def run(args) -> bool:
+    timeout = httpx.Timeout(args.timeout)
+    if args.base_url:
+        async with httpx.AsyncClient(base_url=args.base_url, timeout=timeout) as client:
+            tester = WebXMediaAPITester(client)
+            success = await tester.run_all_tests()
+    else:
+        # Run against the app in-process with the benchmark's database and Stripe stand-ins
+        from backend_benchmark import WebXMediaAPIBenchmark, server
+
+        harness = WebXMediaAPIBenchmark(mongo_url=args.mongo_url)
+        await harness.setup()
+        try:
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://testserver", timeout=timeout) as client:
+                tester = WebXMediaAPITester(client)
+                success = await tester.run_all_tests()
+        finally:
+            await harness.teardown()
+
+    tester.write_results(args.output)
+    print(f"📄 Results written to {args.output}")
+    return success
+
+
 def main():
-    tester = WebXMediaAPITester()
-    success = tester.run_all_tests()
-    
-    # Save detailed results
-    with open('/app/backend_test_results.json', 'w') as f:
-        json.dump({
-            'summary': {
-                'total_tests': tester.tests_run,
-                'passed_tests': tester.tests_passed,
-                'failed_tests': tester.tests_run - tester.tests_passed,
-                'success_rate': (tester.tests_passed/tester.tests_run)*100 if tester.tests_run > 0 else 0,
-                'timestamp': datetime.now().isoformat()
-            },
-            'detailed_results': tester.test_results
-        }, f, indent=2)
-    
+    parser = argparse.ArgumentParser(description="Web X Media API tests")
+    parser.add_argument("--base-url", help="Test a running deployment instead of the in-process app")
+    parser.add_argument("--mongo-url", help="MongoDB for the in-process app (defaults to an in-memory mock)")
+    parser.add_argument("--timeout", type=float, default=15.0, help="Per-request timeout in seconds")
+    parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT, help="Where to write the JSON results")
+    args = parser.parse_args()
+
+    success = asyncio.run(run(args))
     return 0 if success else 1
 
 if __name__ == "__main__":
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main())
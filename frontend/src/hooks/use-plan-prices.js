@@ -0,0 +1,29 @@
+import { useEffect, useState } from 'react';
+
+// Prices come from the backend plan catalog, which is what checkout actually charges.
+// Until it loads (or if it fails) the page's built-in prices are shown.
+export function usePlanPrices() {
+  const [prices, setPrices] = useState({});
+
+  useEffect(() => {
+    let cancelled = false;
+
+    fetch(`${process.env.REACT_APP_BACKEND_URL}/api/plans`)
+      .then((response) => (response.ok ? response.json() : { plans: [] }))
+      .then((data) => {
+        if (cancelled) return;
+        const catalog = {};
+        data.plans.forEach((plan) => {
+          catalog[plan.id] = plan.amount;
+        });
+        setPrices(catalog);
+      })
+      .catch((err) => console.error('Error loading plan prices:', err));
+
+    return () => {
+      cancelled = true;
+    };
+  }, []);
+
+  return prices;
+}
@@ -1,6 +1,7 @@
 import React, { useState, useEffect } from 'react';
 import { useLocation, useNavigate } from 'react-router-dom';
 import { Button } from '../components/ui/button';
+import { usePlanPrices } from '../hooks/use-plan-prices';
 import {
   CreditCard,
   Shield,
@@ -25,7 +26,7 @@ const Checkout = () => {
   // Get plan details from URL parameters
   const searchParams = new URLSearchParams(location.search);
   const planType = searchParams.get('plan') || 'bronze';
-  const planPrice = searchParams.get('price');
+  const planPrices = usePlanPrices();
 
   const plans = {
     bronze: {
@@ -94,7 +95,8 @@ const Checkout = () => {
   };
 
   const selectedPlan = plans[planType] || plans.bronze;
-  const finalPrice = planPrice ? parseFloat(planPrice) : selectedPlan.price;
+  // Show what checkout will charge, never a price carried in the URL
+  const finalPrice = planPrices[planType] ?? selectedPlan.price;
 
   useEffect(() => {
     if (selectedPlan.isCustom) {
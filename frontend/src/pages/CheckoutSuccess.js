@@ -23,14 +23,51 @@ const CheckoutSuccess = () => {
   const sessionId = searchParams.get('session_id');
 
   useEffect(() => {
-    if (sessionId) {
-      checkPaymentStatus(sessionId);
-    } else {
+    if (!sessionId) {
       setError('No session ID found');
       setPaymentStatus('error');
+      return;
+    }
+
+    if (!window.EventSource) {
+      checkPaymentStatus(sessionId);
+      return;
     }
+
+    // The server pushes one event once the payment settles; fall back to polling if the stream fails
+    const source = new EventSource(
+      `${process.env.REACT_APP_BACKEND_URL}/api/checkout/status/${sessionId}/stream`
+    );
+    const fallBackToPolling = () => {
+      source.close();
+      checkPaymentStatus(sessionId);
+    };
+
+    source.addEventListener('status', (event) => {
+      source.close();
+      applyPaymentStatus(JSON.parse(event.data));
+    });
+    source.addEventListener('timeout', fallBackToPolling);
+    source.onerror = fallBackToPolling;
+
+    return () => source.close();
   }, [sessionId]);
 
+  // Returns true once the session has reached a final state
+  const applyPaymentStatus = (data) => {
+    if (data.payment_status === 'paid') {
+      setPaymentDetails(data);
+      setPaymentStatus('success');
+      return true;
+    }
+    if (data.status === 'expired') {
+      setError('Payment session expired');
+      setPaymentStatus('error');
+      return true;
+    }
+    return false;
+  };
+
   const checkPaymentStatus = async (sessionId, attempts = 0) => {
     const maxAttempts = 5;
     const pollInterval = 2000; // 2 seconds
@@ -52,13 +89,7 @@ const CheckoutSuccess = () => {
 
       const data = await response.json();
       
-      if (data.payment_status === 'paid') {
-        setPaymentDetails(data);
-        setPaymentStatus('success');
-      } else if (data.status === 'expired') {
-        setError('Payment session expired');
-        setPaymentStatus('error');
-      } else {
+      if (!applyPaymentStatus(data)) {
         // Continue polling if payment is still pending
         setTimeout(() => checkPaymentStatus(sessionId, attempts + 1), pollInterval);
       }
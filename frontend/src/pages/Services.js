@@ -1,6 +1,7 @@
 import React from 'react';
 import { Link } from 'react-router-dom';
 import { Button } from '../components/ui/button';
+import { usePlanPrices } from '../hooks/use-plan-prices';
 import {
   Globe,
   ShoppingCart,
@@ -17,6 +18,8 @@ import {
 } from 'lucide-react';
 
 const Services = () => {
+  const planPrices = usePlanPrices();
+
   const services = [
     {
       icon: <Globe className="w-12 h-12" />,
@@ -287,7 +290,9 @@ const Services = () => {
           </div>
 
           <div className="grid md:grid-cols-3 gap-8 max-w-6xl mx-auto">
-            {pricingPlans.map((plan, index) => (
+            {pricingPlans.map((basePlan, index) => {
+              const plan = { ...basePlan, price: planPrices[basePlan.name.toLowerCase()] ?? basePlan.price };
+              return (
               <div 
                 key={index} 
                 className={`relative bg-white rounded-2xl shadow-lg border-2 transition-all duration-300 hover:shadow-xl ${
@@ -339,7 +344,8 @@ const Services = () => {
                   </Link>
                 </div>
               </div>
-            ))}
+              );
+            })}
           </div>
 
           {/* Custom Plan */}
@@ -0,0 +1,43 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import httpx
+from mongomock_motor import AsyncMongoMockClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+
+ADMIN_REQUESTS = [
+    ("GET", "/api/export/contacts"),
+    ("GET", "/api/admin/stats"),
+    ("POST", "/api/plans/reload"),
+    ("POST", "/api/admin/reconcile"),
+]
+
+
+def call_admin_endpoints(headers):
+    async def run():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return [(await http.request(method, path, headers=headers)).status_code
+                    for method, path in ADMIN_REQUESTS]
+
+    return asyncio.run(run())
+
+
+def test_admin_endpoints_are_disabled_without_a_key(monkeypatch):
+    monkeypatch.setattr(server, "db", AsyncMongoMockClient()["admin_disabled_test"])
+    monkeypatch.setattr(server, "admin_api_key", "")
+
+    assert call_admin_endpoints({"X-Admin-Key": ""}) == [403] * 4
+
+
+def test_admin_endpoints_require_the_key(monkeypatch):
+    monkeypatch.setattr(server, "db", AsyncMongoMockClient()["admin_auth_test"])
+    monkeypatch.setattr(server, "admin_api_key", "s3cret")
+
+    assert call_admin_endpoints({}) == [401] * 4
+    assert call_admin_endpoints({"X-Admin-Key": "wrong"}) == [401] * 4
+    assert call_admin_endpoints({"X-Admin-Key": "s3cret"}) == [200] * 4
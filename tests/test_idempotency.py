@@ -0,0 +1,144 @@
+import asyncio
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+from mongomock_motor import AsyncMongoMockClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+
+
+class SessionFactory:
+    """Stands in for opening a checkout session: counts calls and answers after `delay` seconds."""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return {"url": f"https://checkout.test/{self.calls}", "session_id": f"cs_{self.calls}"}
+
+
+def make_store(**kwargs):
+    return server.IdempotencyStore(3600, poll_interval=0.01, **kwargs)
+
+
+def test_replay_returns_stored_response(monkeypatch):
+    monkeypatch.setattr(server, "db", AsyncMongoMockClient()["idempotency_replay_test"])
+    create = SessionFactory()
+
+    async def run():
+        first = await make_store().run("key-1", "fp", create)
+        # A fresh store has no in-process state, like another worker
+        second = await make_store().run("key-1", "fp", create)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == second
+    assert create.calls == 1
+
+
+def test_concurrent_duplicates_create_once(monkeypatch):
+    monkeypatch.setattr(server, "db", AsyncMongoMockClient()["idempotency_concurrent_test"])
+    create = SessionFactory(delay=0.1)
+    workers = [make_store(), make_store()]
+
+    async def run():
+        return await asyncio.gather(*[
+            workers[index % 2].run("key-1", "fp", create) for index in range(6)
+        ])
+
+    responses = asyncio.run(run())
+    assert create.calls == 1
+    assert all(response == responses[0] for response in responses)
+
+
+def test_mismatched_fingerprint_is_rejected(monkeypatch):
+    monkeypatch.setattr(server, "db", AsyncMongoMockClient()["idempotency_mismatch_test"])
+    create = SessionFactory(delay=0.1)
+
+    async def run():
+        owner = asyncio.create_task(make_store().run("key-1", "fp", create))
+        await asyncio.sleep(0.02)
+        with pytest.raises(HTTPException) as in_progress:
+            await make_store().run("key-1", "other", create)
+        await owner
+        with pytest.raises(HTTPException) as completed:
+            await make_store().run("key-1", "other", create)
+        return in_progress.value, completed.value
+
+    in_progress, completed = asyncio.run(run())
+    assert in_progress.status_code == 422
+    assert completed.status_code == 422
+    assert create.calls == 1
+
+
+def test_orphaned_key_is_taken_over(monkeypatch):
+    monkeypatch.setattr(server, "db", AsyncMongoMockClient()["idempotency_orphan_test"])
+    create = SessionFactory()
+    now = datetime.now(timezone.utc)
+
+    async def run():
+        # Left behind by a worker that died between claiming the key and completing it
+        await server.db.idempotency_keys.insert_one({
+            "_id": "key-1", "state": "in_progress", "fingerprint": "fp", "owner": "dead-worker",
+            "locked_until": now - timedelta(seconds=1), "created_at": now - timedelta(seconds=30)
+        })
+        response = await make_store(wait_timeout=1.0).run("key-1", "fp", create)
+        return response, await server.db.idempotency_keys.find_one({"_id": "key-1"})
+
+    response, record = asyncio.run(run())
+    assert create.calls == 1
+    assert record["state"] == "completed"
+    assert record["response"] == response
+
+
+def test_live_key_still_conflicts(monkeypatch):
+    monkeypatch.setattr(server, "db", AsyncMongoMockClient()["idempotency_live_test"])
+    now = datetime.now(timezone.utc)
+
+    async def run():
+        await server.db.idempotency_keys.insert_one({
+            "_id": "key-1", "state": "in_progress", "fingerprint": "fp", "owner": "busy-worker",
+            "locked_until": now + timedelta(seconds=60), "created_at": now
+        })
+        with pytest.raises(HTTPException) as excinfo:
+            await make_store(wait_timeout=0.05).run("key-1", "fp", SessionFactory())
+        return excinfo.value
+
+    assert asyncio.run(run()).status_code == 409
+
+
+def test_failed_create_releases_key(monkeypatch):
+    monkeypatch.setattr(server, "db", AsyncMongoMockClient()["idempotency_failure_test"])
+    create = SessionFactory()
+
+    async def failing():
+        raise RuntimeError("provider down")
+
+    async def run():
+        store = make_store()
+        with pytest.raises(RuntimeError):
+            await store.run("key-1", "fp", failing)
+        return await store.run("key-1", "fp", create)
+
+    assert asyncio.run(run())["session_id"] == "cs_1"
+
+
+def test_failed_completion_write_still_returns_session(monkeypatch):
+    monkeypatch.setattr(server, "db", AsyncMongoMockClient()["idempotency_record_test"])
+    create = SessionFactory()
+
+    async def broken_update(*args, **kwargs):
+        raise RuntimeError("write failed")
+
+    monkeypatch.setattr(type(server.db.idempotency_keys), "update_one", broken_update)
+
+    response = asyncio.run(make_store().run("key-1", "fp", create))
+    assert response["session_id"] == "cs_1"
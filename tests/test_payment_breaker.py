@@ -0,0 +1,262 @@
+import asyncio
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+
+
+class FakeProvider:
+    """Stands in for StripeCheckout: answers after `delay` seconds, or raises `error`."""
+
+    def __init__(self, delay: float = 0.0, error: Exception = None):
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    async def get_checkout_status(self, session_id):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return SimpleNamespace(status="complete", payment_status="paid", amount_total=2000,
+                               currency="usd", metadata={"plan_type": "gold"})
+
+
+class BlockingProvider(FakeProvider):
+    """Like the real SDK: a coroutine that blocks in synchronous I/O."""
+
+    async def get_checkout_status(self, session_id):
+        self.calls += 1
+        time.sleep(self.delay)
+        return SimpleNamespace(status="open", payment_status="unpaid", amount_total=2000,
+                               currency="usd", metadata={})
+
+
+class CountingProvider(BlockingProvider):
+    """Blocking provider that records how many calls ran at the same time."""
+
+    def __init__(self, delay: float = 0.0):
+        super().__init__(delay)
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    async def get_checkout_status(self, session_id):
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            return await super().get_checkout_status(session_id)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+class ProviderClientError(Exception):
+    http_status = 404
+
+
+def make_client(provider, call_timeout=0.05, threshold=2, reset_timeout=30.0, pool_size=10):
+    client = server.PaymentClient("sk_test", pool_size=pool_size, call_timeout=call_timeout,
+                                  breaker=server.CircuitBreaker(threshold, reset_timeout))
+    # Skip the SDK import; the client talks to the fake provider directly
+    client._checkouts[""] = provider
+    return client
+
+
+def test_slow_call_hits_deadline():
+    client = make_client(FakeProvider(delay=0.3))
+
+    async def run():
+        start = time.perf_counter()
+        with pytest.raises(server.PaymentUnavailableError):
+            await client.get_checkout_status("cs_slow")
+        return time.perf_counter() - start
+
+    # The abandoned call finishes in its worker thread, so time only the caller's wait
+    assert asyncio.run(run()) < 0.2
+    assert client.breaker.failures == 1
+    assert client.breaker.state == "closed"
+
+
+def test_blocking_call_hits_deadline_without_stalling_loop():
+    client = make_client(BlockingProvider(delay=0.3), call_timeout=0.05)
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        start = time.perf_counter()
+        with pytest.raises(server.PaymentUnavailableError):
+            await client.get_checkout_status("cs_blocking")
+        elapsed = time.perf_counter() - start
+        task.cancel()
+        return elapsed, ticks
+
+    elapsed, ticks = asyncio.run(run())
+    assert elapsed < 0.2
+    assert ticks >= 2
+    assert client.breaker.failures == 1
+
+
+def test_queued_calls_do_not_count_toward_deadline():
+    provider = CountingProvider(delay=0.1)
+    # Ten calls through two workers take 0.5 s, but each call itself only 0.1 s
+    client = make_client(provider, call_timeout=0.3, threshold=1, pool_size=2)
+
+    async def run():
+        return await asyncio.gather(*[client.get_checkout_status(f"cs_{index}") for index in range(10)])
+
+    results = asyncio.run(run())
+    assert len(results) == 10
+    assert provider.peak == 2
+    assert client.breaker.state == "closed"
+    assert client.breaker.failures == 0
+
+
+def test_checkout_is_built_off_the_event_loop(monkeypatch):
+    provider = FakeProvider()
+    client = make_client(provider)
+    built_on = []
+
+    def build_checkout(webhook_url=""):
+        # Stands in for the first call, which imports the SDK
+        built_on.append(threading.current_thread())
+        return provider
+
+    monkeypatch.setattr(client, "_checkout", build_checkout)
+
+    async def run():
+        await client.preload()
+        await client.get_checkout_status("cs_fast")
+
+    asyncio.run(run())
+    assert len(built_on) == 2
+    assert threading.main_thread() not in built_on
+
+
+def test_breaker_opens_and_fails_fast():
+    provider = FakeProvider(delay=0.3)
+    client = make_client(provider, threshold=2)
+
+    async def run():
+        for _ in range(2):
+            with pytest.raises(server.PaymentUnavailableError):
+                await client.get_checkout_status("cs_slow")
+        start = time.perf_counter()
+        with pytest.raises(server.PaymentUnavailableError) as excinfo:
+            await client.get_checkout_status("cs_slow")
+        return time.perf_counter() - start, excinfo.value
+
+    elapsed, error = asyncio.run(run())
+    assert elapsed < 0.01
+    assert provider.calls == 2
+    assert client.breaker.state == "open"
+    assert client.breaker.trips == 1
+    assert error.retry_after > 1
+
+
+def test_half_open_probe_closes_breaker():
+    provider = FakeProvider(delay=0.3)
+    client = make_client(provider, threshold=1, reset_timeout=0.05)
+
+    async def run():
+        with pytest.raises(server.PaymentUnavailableError):
+            await client.get_checkout_status("cs_slow")
+        assert client.breaker.state == "open"
+        await asyncio.sleep(0.06)
+        provider.delay = 0
+        return await client.get_checkout_status("cs_fast")
+
+    result = asyncio.run(run())
+    assert result.payment_status == "paid"
+    assert client.breaker.state == "closed"
+    assert client.breaker.failures == 0
+
+
+def test_failed_probe_reopens_breaker():
+    provider = FakeProvider(delay=0.3)
+    client = make_client(provider, threshold=1, reset_timeout=0.05)
+
+    async def run():
+        with pytest.raises(server.PaymentUnavailableError):
+            await client.get_checkout_status("cs_slow")
+        await asyncio.sleep(0.06)
+        with pytest.raises(server.PaymentUnavailableError):
+            await client.get_checkout_status("cs_slow")
+
+    asyncio.run(run())
+    assert client.breaker.state == "open"
+    assert client.breaker.trips == 2
+
+
+def test_cancelled_probe_does_not_wedge_breaker():
+    provider = FakeProvider(delay=0.3)
+    client = make_client(provider, call_timeout=2.0, threshold=1, reset_timeout=0.05)
+    client.breaker.record_failure()
+
+    async def run():
+        await asyncio.sleep(0.06)
+        probe = asyncio.create_task(client.get_checkout_status("cs_probe"))
+        await asyncio.sleep(0.02)
+        probe.cancel()
+        await asyncio.gather(probe, return_exceptions=True)
+        provider.delay = 0
+        return await client.get_checkout_status("cs_next")
+
+    assert asyncio.run(run()).payment_status == "paid"
+    assert client.breaker.state == "closed"
+
+
+def test_client_errors_do_not_trip():
+    client = make_client(FakeProvider(error=ProviderClientError("No such checkout session")), threshold=1)
+
+    with pytest.raises(ProviderClientError):
+        asyncio.run(client.get_checkout_status("cs_missing"))
+    assert client.breaker.state == "closed"
+
+
+def test_status_route_serves_last_known_status_when_open(monkeypatch):
+    client = make_client(FakeProvider(delay=0.3), threshold=1)
+    client.breaker.record_failure()
+    monkeypatch.setattr(server, "db", AsyncMongoMockClient()["breaker_test"])
+    monkeypatch.setattr(server, "payment_client", client)
+
+    known = f"cs_{uuid.uuid4().hex}"
+    unknown = f"cs_{uuid.uuid4().hex}"
+
+    async def run():
+        await server.db.payment_transactions.insert_one({
+            "id": str(uuid.uuid4()), "session_id": known, "amount": 20.0, "currency": "usd",
+            "plan_type": "gold", "payment_status": "unpaid", "status": "open",
+            "metadata": {"plan_name": "Gold"}, "created_at": datetime.now(timezone.utc)
+        })
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return (
+                await http.get(f"/api/checkout/status/{known}"),
+                await http.get(f"/api/checkout/status/{unknown}"),
+            )
+
+    cached, missing = asyncio.run(run())
+    assert cached.status_code == 200
+    assert cached.json()["payment_status"] == "unpaid"
+    assert missing.status_code == 503
+    assert int(missing.headers["retry-after"]) >= 1
@@ -0,0 +1,51 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import httpx
+from mongomock_motor import AsyncMongoMockClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+
+
+def post_contacts(headers_for):
+    async def run():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            statuses = []
+            for index in range(8):
+                # A fresh email each time so only the per-IP limit applies
+                response = await http.post("/api/contact", headers=headers_for(index), json={
+                    "name": "Rate Test", "email": f"rate{index}@example.com", "phone": "1",
+                    "service": "SEO", "message": "hello"
+                })
+                statuses.append(response.status_code)
+            return statuses
+
+    return asyncio.run(run())
+
+
+def setup_limits(monkeypatch, name):
+    monkeypatch.setattr(server, "db", AsyncMongoMockClient()[name])
+    monkeypatch.setattr(server, "rate_limit_enabled", True)
+    monkeypatch.setattr(server, "trusted_proxy_count", 1)
+    monkeypatch.setattr(server, "rate_limiters", {
+        "contact": server.TokenBucketLimiter(5, 60),
+        "checkout": server.TokenBucketLimiter(10, 60)
+    })
+
+
+def test_spoofed_forwarded_for_is_still_limited(monkeypatch):
+    setup_limits(monkeypatch, "rate_spoof_test")
+    # The client varies the leftmost hop; the ingress appends the real address last
+    statuses = post_contacts(lambda index: {"X-Forwarded-For": f"10.0.0.{index}, 203.0.113.7"})
+    assert statuses[:5] == [200] * 5
+    assert statuses[5:] == [429] * 3
+
+
+def test_distinct_clients_behind_proxy_are_separate(monkeypatch):
+    setup_limits(monkeypatch, "rate_distinct_test")
+    statuses = post_contacts(lambda index: {"X-Forwarded-For": f"203.0.113.{index}"})
+    assert statuses == [200] * 8
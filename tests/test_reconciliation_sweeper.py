@@ -0,0 +1,88 @@
+import asyncio
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+from mongomock_motor import AsyncMongoMockClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+
+
+class StubProvider:
+    """Reports every session as paid and records which ones were asked about."""
+
+    def __init__(self):
+        self.seen = []
+
+    async def get_checkout_status(self, session_id):
+        self.seen.append(session_id)
+        return SimpleNamespace(status="complete", payment_status="paid", amount_total=2000,
+                               currency="usd", metadata={})
+
+
+async def insert_stale(count, created_at):
+    await server.db.payment_transactions.insert_many([
+        {"id": f"tx{index}", "session_id": f"cs_{index}", "amount": 20.0, "currency": "usd",
+         "plan_type": "gold", "payment_status": "unpaid", "status": "open", "created_at": created_at}
+        for index in range(count)
+    ])
+
+
+class PartialProvider(StubProvider):
+    """Reports only cs_0 as paid; every other session is still open and unpaid."""
+
+    async def get_checkout_status(self, session_id):
+        self.seen.append(session_id)
+        paid = session_id == "cs_0"
+        return SimpleNamespace(status="complete" if paid else "open", payment_status="paid" if paid else "unpaid",
+                               amount_total=2000, currency="usd", metadata={})
+
+
+def make_sweeper(batch_size=2):
+    return server.ReconciliationSweeper(interval=0, min_age=60, batch_size=batch_size, concurrency=2, rate=0)
+
+
+def test_sweep_pages_through_shared_timestamps(monkeypatch):
+    monkeypatch.setattr(server, "db", AsyncMongoMockClient()["sweeper_test"])
+    provider = StubProvider()
+    # Mongo keeps milliseconds, so a burst of checkouts easily shares one timestamp
+    created_at = (datetime.now(timezone.utc) - timedelta(hours=1)).replace(microsecond=0)
+
+    async def run():
+        await insert_stale(5, created_at)
+        return await make_sweeper().sweep(provider)
+
+    stats = asyncio.run(run())
+    assert stats["checked"] == 5
+    assert stats["updated"] == 5
+    assert sorted(provider.seen) == [f"cs_{index}" for index in range(5)]
+
+
+def test_run_once_respects_lease(monkeypatch):
+    monkeypatch.setattr(server, "db", AsyncMongoMockClient()["sweeper_lease_test"])
+    monkeypatch.setattr(server, "payment_client", StubProvider())
+
+    async def run():
+        await insert_stale(1, datetime.now(timezone.utc) - timedelta(hours=1))
+        await server.acquire_lease("reconciliation_sweeper", 300, "another-worker")
+        return await make_sweeper().run_once()
+
+    assert asyncio.run(run()) is None
+
+
+def test_sweep_notifies_only_changed_sessions(monkeypatch):
+    monkeypatch.setattr(server, "db", AsyncMongoMockClient()["sweeper_notify_test"])
+    notified = []
+    monkeypatch.setattr(server, "status_changed", notified.append)
+
+    async def run():
+        await insert_stale(4, datetime.now(timezone.utc) - timedelta(hours=1))
+        return await make_sweeper(batch_size=10).sweep(PartialProvider())
+
+    stats = asyncio.run(run())
+    assert stats["checked"] == 4
+    assert stats["updated"] == 1
+    assert notified == ["cs_0"]
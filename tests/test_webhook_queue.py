@@ -0,0 +1,154 @@
+import asyncio
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+import httpx
+from mongomock_motor import AsyncMongoMockClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+
+
+class StubWebhookProvider:
+    """Accepts every webhook body as a checkout.session.completed event with the given ID."""
+
+    async def handle_webhook(self, body, signature):
+        return SimpleNamespace(event_id=body.decode(), event_type="checkout.session.completed",
+                               session_id="cs_dup", payment_status="paid")
+
+
+async def insert_event(event_id, session_id, payment_status="paid", **fields):
+    now = datetime.now(timezone.utc)
+    await server.db.webhook_events.insert_one({
+        "_id": event_id, "event_type": "checkout.session.completed", "session_id": session_id,
+        "payment_status": payment_status, "state": "pending", "attempts": 0,
+        "received_at": now, "next_attempt_at": now, **fields
+    })
+
+
+async def insert_transaction(session_id, payment_status="unpaid"):
+    await server.db.payment_transactions.insert_one({
+        "id": f"tx_{session_id}", "session_id": session_id, "amount": 20.0, "currency": "usd",
+        "plan_type": "gold", "payment_status": payment_status, "status": "open",
+        "created_at": datetime.now(timezone.utc)
+    })
+
+
+def make_processor(**kwargs):
+    return server.WebhookProcessor(workers=1, batch_size=10, max_attempts=3, backoff=1.0, **kwargs)
+
+
+def test_concurrent_claims_never_share_an_event(monkeypatch):
+    monkeypatch.setattr(server, "db", AsyncMongoMockClient()["webhook_claim_test"])
+    processor = make_processor()
+
+    async def run():
+        for index in range(6):
+            await insert_event(f"evt_{index}", f"cs_{index}")
+        # Not due yet
+        await insert_event("evt_later", "cs_later",
+                           next_attempt_at=datetime.now(timezone.utc) + timedelta(minutes=5))
+        return await asyncio.gather(processor._claim_batch(), processor._claim_batch())
+
+    first, second = asyncio.run(run())
+    first_ids = {event["_id"] for event in first}
+    second_ids = {event["_id"] for event in second}
+    assert not first_ids & second_ids
+    assert first_ids | second_ids == {f"evt_{index}" for index in range(6)}
+
+
+def test_expired_claim_is_taken_over(monkeypatch):
+    monkeypatch.setattr(server, "db", AsyncMongoMockClient()["webhook_lease_test"])
+    processor = make_processor(lease=60.0)
+    now = datetime.now(timezone.utc)
+
+    async def run():
+        await insert_event("evt_stale", "cs_stale", state="processing", claim="crashed-worker",
+                           claimed_at=now - timedelta(minutes=5))
+        await insert_event("evt_live", "cs_live", state="processing", claim="live-worker",
+                           claimed_at=now)
+        return await processor._claim_batch()
+
+    claimed = asyncio.run(run())
+    assert [event["_id"] for event in claimed] == ["evt_stale"]
+    assert claimed[0]["claim"] != "crashed-worker"
+
+
+def test_failed_batches_back_off_then_fail(monkeypatch):
+    monkeypatch.setattr(server, "db", AsyncMongoMockClient()["webhook_retry_test"])
+    processor = make_processor()
+
+    async def broken_write(changes):
+        raise RuntimeError("write failed")
+
+    monkeypatch.setattr(server, "write_status_changes", broken_write)
+
+    async def run():
+        await insert_transaction("cs_retry")
+        await insert_event("evt_retry", "cs_retry")
+        states = []
+        for _ in range(3):
+            # Make the scheduled retry due immediately
+            await server.db.webhook_events.update_one(
+                {"_id": "evt_retry"}, {"$set": {"next_attempt_at": datetime.now(timezone.utc)}}
+            )
+            events = await processor._claim_batch()
+            started = datetime.now(timezone.utc)
+            await processor._apply(events)
+            event = await server.db.webhook_events.find_one({"_id": "evt_retry"})
+            delay = event["next_attempt_at"].replace(tzinfo=timezone.utc) - started
+            states.append((event["state"], event["attempts"], round(delay.total_seconds())))
+        return states
+
+    assert asyncio.run(run()) == [("pending", 1, 1), ("pending", 2, 2), ("failed", 3, 4)]
+    assert processor.failed_batches == 3
+
+
+def test_apply_updates_transaction_and_marks_events(monkeypatch):
+    monkeypatch.setattr(server, "db", AsyncMongoMockClient()["webhook_apply_test"])
+    processor = make_processor()
+
+    async def run():
+        await insert_transaction("cs_apply")
+        await insert_event("evt_open", "cs_apply", payment_status="unpaid")
+        await insert_event("evt_paid", "cs_apply", payment_status="paid")
+        await processor._apply(await processor._claim_batch())
+        transaction = await server.db.payment_transactions.find_one({"session_id": "cs_apply"})
+        states = await server.db.webhook_events.distinct("state")
+        return transaction["payment_status"], states
+
+    assert asyncio.run(run()) == ("paid", ["applied"])
+    assert processor.applied_total == 2
+
+
+def test_late_event_never_reverts_paid(monkeypatch):
+    monkeypatch.setattr(server, "db", AsyncMongoMockClient()["webhook_paid_test"])
+    processor = make_processor()
+
+    async def run():
+        await insert_transaction("cs_paid", payment_status="paid")
+        await insert_event("evt_late", "cs_paid", payment_status="unpaid")
+        await processor._apply(await processor._claim_batch())
+        transaction = await server.db.payment_transactions.find_one({"session_id": "cs_paid"})
+        event = await server.db.webhook_events.find_one({"_id": "evt_late"})
+        return transaction["payment_status"], event["state"]
+
+    assert asyncio.run(run()) == ("paid", "applied")
+
+
+def test_redelivered_event_is_stored_once(monkeypatch):
+    monkeypatch.setattr(server, "db", AsyncMongoMockClient()["webhook_dedup_test"])
+    monkeypatch.setattr(server, "payment_client", StubWebhookProvider())
+
+    async def run():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            responses = [await http.post("/api/webhook/stripe", content=b"evt_dup") for _ in range(2)]
+        return responses, await server.db.webhook_events.count_documents({})
+
+    responses, stored = asyncio.run(run())
+    assert [response.status_code for response in responses] == [200, 200]
+    assert stored == 1